@@ -0,0 +1,77 @@
+#!/usr/bin/python
+"""
+Measures the per-invocation latency of the log shipper with the
+warm-container client pool, and with a new client built for every call as
+the shipper used to do. The AWS endpoints are answered in-process, so the
+figures only cover the client side (construction, signing, parsing) and not
+the TLS handshakes saved by the pool.
+
+    python BENCHMARKS/bench_client_pool.py [--invocations 50] [--records 1000]
+"""
+import argparse
+import gzip
+import json
+import statistics
+import time
+
+import boto3
+
+from fake_aws import FakeAWS, Context, LINKED_ACCOUNT, s3_event, setup_environment
+
+setup_environment()
+
+import LogShipper as shipper
+
+KEY = 'AWSLogs/' + LINKED_ACCOUNT + '/CloudTrail/eu-west-1/2024/01/01/file.json.gz'
+
+
+def build_object(records):
+    start = int(time.time()) - 3600
+    events = [{
+        'eventVersion': '1.08',
+        'eventTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(start + i // 10)),
+        'eventSource': 'ec2.amazonaws.com',
+        'eventName': 'DescribeInstances',
+        'awsRegion': 'eu-west-1',
+        'recipientAccountId': LINKED_ACCOUNT,
+    } for i in range(records)]
+    return gzip.compress(json.dumps({'Records': events}).encode('utf-8'))
+
+
+def measure(invocations):
+    timings = []
+    for _ in range(invocations):
+        event = s3_event([KEY], event_time=time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()))
+        start = time.perf_counter()
+        shipper.lambda_handler(event, Context())
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    print('%-28s mean %8.2f ms   p50 %8.2f ms   max %8.2f ms' % (
+        label, statistics.mean(timings), statistics.median(timings), max(timings)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--invocations', type=int, default=50)
+    parser.add_argument('--records', type=int, default=1000)
+    args = parser.parse_args()
+
+    fake = FakeAWS()
+    fake.install()
+    fake.add_object(KEY, data=build_object(args.records))
+
+    pooled_get_client = shipper.get_client
+    # previous behaviour: a new client for every call
+    shipper.get_client = lambda service_name: boto3.client(service_name)
+    report('client per call (before)', measure(args.invocations))
+
+    shipper.get_client = pooled_get_client
+    shipper.get_client('sts')
+    report('client pool (after)', measure(args.invocations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+"""
+Measures the cold start and warm invocation latency of the log shipper. Every
+cold start is a new process importing LogShipper as the Lambda init phase does
+(AWS_LAMBDA_FUNCTION_NAME set), then invoking it once cold and --warm times
+warm. Each scenario is measured with the SecLog account resolved with STS and
+given by SECLOG_ACCOUNT_ID. The AWS endpoints are the in-process fakes of
+fake_aws.py, with --latency milliseconds added to every call to stand for the
+network round trip.
+
+    python BENCHMARKS/bench_cold_start.py [--runs 5] [--warm 20] [--records 100] [--latency 20]
+
+    init        import of the module, clients and settings resolved by init_container()
+    first       first invocation of the container
+    warm        mean of the following invocations
+    calls       AWS API calls of the init phase / of each warm invocation
+
+To measure a deployed function, compare the REPORT lines of its log group in
+CloudWatch Logs Insights, the Init Duration being only reported for cold starts:
+
+    filter @type = "REPORT"
+    | stats count(*), avg(@initDuration), avg(@duration), pct(@duration, 99) by ispresent(@initDuration)
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from fake_aws import FakeAWS, Context, SECLOG_ACCOUNT, s3_event, setup_environment
+import fixtures
+
+KEY = fixtures.object_key('CloudTrail', 0)
+
+
+def build_object(records):
+    start = int(time.time())
+    payload = {'Records': [fixtures.cloudtrail_record(random.Random(index), start - 60) for index in range(records)]}
+    return gzip.compress(json.dumps(payload).encode('utf-8'))
+
+
+def run_container(records, warm, latency):
+    """
+    Imports the shipper in this process as a new container would and invokes it.
+    Runs in the container process.
+    """
+    setup_environment()
+    os.environ['AWS_LAMBDA_FUNCTION_NAME'] = 'benchmark'
+    fake = FakeAWS(latency)
+    fake.install()
+    fake.add_object(KEY, data=build_object(records))
+
+    start = time.perf_counter()
+    import LogShipper as shipper
+    init = (time.perf_counter() - start) * 1000
+    init_calls = sum(fake.calls.values())
+
+    timings = []
+    for _ in range(warm + 1):
+        fake.reset()
+        event = s3_event([KEY], event_time=time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()))
+        start = time.perf_counter()
+        shipper.lambda_handler(event, Context())
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'init': init, 'first': timings[0], 'warm': statistics.mean(timings[1:]) if warm else 0,
+            'init_calls': init_calls, 'warm_calls': sum(fake.calls.values())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='cold starts per scenario')
+    parser.add_argument('--warm', type=int, default=20, help='warm invocations per cold start')
+    parser.add_argument('--records', type=int, default=100, help='records of the shipped object')
+    parser.add_argument('--latency', type=float, default=20, help='milliseconds added to every AWS call')
+    parser.add_argument('--container', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.container:
+        print(json.dumps(run_container(args.records, args.warm, args.latency)))
+        return
+
+    print('%-28s %10s %10s %10s %12s' % ('scenario', 'init', 'first', 'warm', 'calls'))
+    for label, account in (('identity from STS', None), ('SECLOG_ACCOUNT_ID', SECLOG_ACCOUNT)):
+        environment = dict(os.environ)
+        environment.pop('SECLOG_ACCOUNT_ID', None)
+        if account is not None:
+            environment['SECLOG_ACCOUNT_ID'] = account
+        results = []
+        for _ in range(args.runs):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--container', '--records', str(args.records),
+                 '--warm', str(args.warm), '--latency', str(args.latency)],
+                check=True, stdout=subprocess.PIPE, universal_newlines=True, env=environment).stdout
+            results.append(json.loads(output.splitlines()[-1]))
+        print('%-28s %8.1fms %8.1fms %8.1fms %6d / %-4d' % (
+            label, *[statistics.mean(result[phase] for result in results) for phase in ('init', 'first', 'warm')],
+            results[0]['init_calls'], results[0]['warm_calls']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/python
+"""
+Offline benchmark of the log shipper on synthetic CloudTrail, CloudTrail Insights
+and AWS Config files. Each scenario invokes LogShipper.lambda_handler in its own
+process, against the in-process fake of STS, S3, DynamoDB and CloudWatch Logs,
+and reports the throughput, the peak RSS, the time spent in each phase and the
+AWS API calls made per S3 object.
+
+    python BENCHMARKS/bench_shipper.py [--sources CloudTrail,Config] [--sizes 1000,10000,100000]
+                                       [--objects 1] [--sink cloudwatch|firehose] [--archive]
+                                       [--fixtures DIRECTORY] [--json FILE]
+
+The phases read, decompress, parse and batch (serialization and batching) run
+on the invocation thread, one after the other. upload (PutLogEvents or
+PutRecordBatch, retries included) and checkpoint (ingestion ledger updates) run on the uploader thread
+and overlap with them. claim is the ledger update made before each download.
+archive (--archive, needs pyarrow) is the Parquet copy of the records: the
+rows built on the invocation thread, the row groups written and the files uploaded.
+Fixtures are generated on the first run and reused for an hour.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from fake_aws import FakeAWS, Context, s3_event, setup_environment
+import fixtures
+
+DEFAULT_SIZES = '1000,10000,100000'
+MAX_RECORDS = 500000
+PHASES = ('claim', 'read', 'decompress', 'parse', 'batch', 'upload', 'checkpoint', 'archive')
+
+
+class PhaseTimer:
+    """
+    Accumulates the time spent in the instrumented functions of the shipper, by phase.
+    """
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self.lock:
+            self.seconds[phase] += seconds
+
+    def wrap(self, function, phase):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+        return timed
+
+    def iterate(self, iterable, phase):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(phase, time.perf_counter() - start)
+                return
+            self.add(phase, time.perf_counter() - start)
+            yield item
+
+    def exclusive_millis(self):
+        # the read time is included in decompress, which is included in parse
+        seconds = dict(self.seconds)
+        seconds['parse'] = seconds.get('parse', 0) - seconds.get('decompress', 0)
+        seconds['decompress'] = seconds.get('decompress', 0) - seconds.get('read', 0)
+        return {phase: round(seconds.get(phase, 0) * 1000, 1) for phase in PHASES}
+
+
+class TimedBody:
+    def __init__(self, body, timer):
+        self.body = body
+        self.timer = timer
+
+    def read(self, *args):
+        start = time.perf_counter()
+        try:
+            return self.body.read(*args)
+        finally:
+            self.timer.add('read', time.perf_counter() - start)
+
+
+def instrument(shipper, timer):
+    """
+    Wraps the functions of each phase of the shipper with the timer.
+    """
+    iter_decompressed = shipper.iter_decompressed
+    iter_json_array = shipper.iter_json_array
+    shipper.iter_decompressed = lambda body: timer.iterate(iter_decompressed(TimedBody(body, timer)), 'decompress')
+    shipper.iter_json_array = lambda chunks, field: timer.iterate(iter_json_array(chunks, field), 'parse')
+    shipper.BatchBuilder.add = timer.wrap(shipper.BatchBuilder.add, 'batch')
+    shipper.ship_log_events = timer.wrap(shipper.ship_log_events, 'upload')
+    shipper.put_record_batch = timer.wrap(shipper.put_record_batch, 'upload')
+    shipper.ObjectCheckpoint.claim = timer.wrap(shipper.ObjectCheckpoint.claim, 'claim')
+    shipper.ObjectCheckpoint.save = timer.wrap(shipper.ObjectCheckpoint.save, 'checkpoint')
+    shipper.ObjectCheckpoint.complete = timer.wrap(shipper.ObjectCheckpoint.complete, 'checkpoint')
+    shipper.ParquetArchive.add = timer.wrap(shipper.ParquetArchive.add, 'archive')
+    shipper.ParquetArchive.close = timer.wrap(shipper.ParquetArchive.close, 'archive')
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def uncompressed_size(path):
+    # the gzip trailer holds the uncompressed size modulo 2^32
+    with open(path, 'rb') as gzipped:
+        gzipped.seek(-4, os.SEEK_END)
+        return int.from_bytes(gzipped.read(4), 'little')
+
+
+def run_scenario(source, records, objects, path):
+    """
+    Ships the fixture in one invocation and returns the measures.
+    Runs in the scenario process.
+    """
+    # the embedded metric format records are part of the work of an invocation
+    os.environ['EMIT_METRICS'] = 'true'
+    setup_environment()
+    import LogShipper as shipper
+
+    fake = FakeAWS()
+    fake.install()
+    keys = [fixtures.object_key(source, records).replace('.json.gz', '_%d.json.gz' % index) for index in range(objects)]
+    for key in keys:
+        fake.add_object(key, path=path)
+    timer = PhaseTimer()
+    instrument(shipper, timer)
+    # warm up the clients, as in a warm container
+    for service_name in ('sts', 's3', 'logs', 'firehose', 'dynamodb'):
+        shipper.get_client(service_name)
+    fake.reset()
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    shipper.lambda_handler(s3_event(keys, event_time=time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())), Context())
+    seconds = time.perf_counter() - start
+    return {
+        'source': source,
+        'records': records * objects,
+        'objects': objects,
+        'gzipped_mb': round(os.path.getsize(path) * objects / 1048576, 2),
+        'json_mb': round(uncompressed_size(path) * objects / 1048576, 2),
+        'seconds': round(seconds, 3),
+        'records_per_second': round(records * objects / seconds),
+        'rss_before_mb': round(rss_before, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'phases_ms': timer.exclusive_millis(),
+        'calls_per_object': {operation: round(count / objects, 2) for operation, count in sorted(fake.calls.items())},
+    }
+
+
+def report(results):
+    print('%-19s %8s %8s %8s %8s %10s %9s   %s' % (
+        'source', 'records', 'gz MB', 'json MB', 'seconds', 'records/s', 'peak RSS', '  '.join('%10s' % phase for phase in PHASES)))
+    for result in results:
+        print('%-19s %8d %8.2f %8.2f %8.2f %10d %8.1fM   %s' % (
+            result['source'], result['records'], result['gzipped_mb'], result['json_mb'], result['seconds'],
+            result['records_per_second'], result['peak_rss_mb'],
+            '  '.join('%8.1fms' % result['phases_ms'][phase] for phase in PHASES)))
+    print()
+    print('AWS API calls per S3 object')
+    for result in results:
+        print('%-19s %8d   %s' % (result['source'], result['records'], ', '.join(
+            '%s %g' % (operation, count) for operation, count in result['calls_per_object'].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', default=','.join(fixtures.SOURCES))
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='records per S3 object, at most %d' % MAX_RECORDS)
+    parser.add_argument('--objects', type=int, default=1, help='S3 objects per invocation')
+    parser.add_argument('--sink', default='cloudwatch', choices=('cloudwatch', 'firehose'), help='output of the shipper')
+    parser.add_argument('--archive', action='store_true', help='also write the Parquet archive of the records')
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), 'seclz-benchmark-fixtures'))
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--scenario', nargs=2, metavar=('SOURCE', 'RECORDS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.makedirs(args.fixtures, exist_ok=True)
+    os.environ['OUTPUT_SINK'] = args.sink
+    os.environ.setdefault('FIREHOSE_DELIVERY_STREAM', 'benchmark')
+    os.environ['ARCHIVE_RECORDS'] = str(args.archive).lower()
+    if args.scenario:
+        source, records = args.scenario[0], int(args.scenario[1])
+        path = fixtures.fixture(args.fixtures, source, records)
+        print(json.dumps(run_scenario(source, records, args.objects, path)))
+        return
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if max(sizes) > MAX_RECORDS:
+        parser.error('at most %d records per object' % MAX_RECORDS)
+    results = []
+    for source in args.sources.split(','):
+        if source not in fixtures.SOURCES:
+            parser.error('unknown source ' + source)
+        for records in sizes:
+            # one process per scenario, so that the peak RSS is its own
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--scenario', source, str(records),
+                 '--objects', str(args.objects), '--sink', args.sink, '--fixtures', args.fixtures]
+                + (['--archive'] if args.archive else []),
+                check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+            # the last line follows the embedded metric format records
+            results.append(json.loads(output.splitlines()[-1]))
+            print('%s %d records: %.2f s' % (source, records, results[-1]['seconds']), file=sys.stderr)
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+"""
+Compares the timestamp conversion of the log shippers with the strptime based
+conversion they used before, on a CloudTrail-like and a Config-like set of
+timestamps (several records per second), and checks both give the same result.
+
+    python BENCHMARKS/bench_timestamps.py [--records 100000] [--per-second 20]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'LAMBDAS'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
+os.environ['TZ'] = 'UTC'
+time.tzset()
+
+import LogShipper as shipper
+
+
+def strptime_millis(value, pattern):
+    dt_obj = datetime.strptime(value, pattern)
+    return int(float(dt_obj.timestamp()) * 1000)
+
+
+def timestamps(records, per_second, with_millis):
+    start = datetime(2024, 1, 1)
+    values = []
+    for i in range(records):
+        moment = start + timedelta(seconds=i // per_second, milliseconds=(i * 37) % 1000)
+        if with_millis:
+            values.append(moment.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (moment.microsecond // 1000))
+        else:
+            values.append(moment.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    return values
+
+
+def run(label, values, pattern):
+    shipper.epoch_seconds.cache_clear()
+    start = time.perf_counter()
+    expected = [strptime_millis(value, pattern) for value in values]
+    before = time.perf_counter() - start
+    start = time.perf_counter()
+    converted = [shipper.to_epoch_millis(value) for value in values]
+    after = time.perf_counter() - start
+    assert converted == expected, label + ': conversions differ'
+    print('%-10s strptime %7.1f ms   to_epoch_millis %7.1f ms   speedup x%.1f' % (
+        label, before * 1000, after * 1000, before / after))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--per-second', type=int, default=20)
+    args = parser.parse_args()
+    run('CloudTrail', timestamps(args.records, args.per_second, False), '%Y-%m-%dT%H:%M:%SZ')
+    run('Config', timestamps(args.records, args.per_second, True), '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+In-process fake of the AWS endpoints called by the log shipper, for the benchmarks.
+The responses are served from a botocore before-send hook of the default boto3
+session: no network access, credentials or extra package (moto) are needed.
+"""
+import io
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter
+
+import boto3
+from botocore.awsrequest import AWSResponse
+
+LAMBDAS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'LAMBDAS')
+SECLOG_ACCOUNT = '111111111111'
+LINKED_ACCOUNT = '222222222222'
+REGION = 'eu-west-1'
+
+
+def setup_environment():
+    """
+    Makes the shipper importable and gives boto3 a region and dummy credentials.
+    """
+    if LAMBDAS_DIRECTORY not in sys.path:
+        sys.path.insert(0, LAMBDAS_DIRECTORY)
+    for name, value in (('AWS_REGION', REGION), ('AWS_DEFAULT_REGION', REGION),
+                        ('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('LOG_LEVEL', 'ERROR'), ('EMIT_METRICS', 'false')):
+        os.environ.setdefault(name, value)
+
+
+class RawResponse(io.BytesIO):
+    def stream(self, **kwargs):
+        contents = self.read()
+        while contents:
+            yield contents
+            contents = self.read()
+
+
+class RawFile(io.FileIO):
+    def stream(self, amt=65536, **kwargs):
+        contents = self.read(amt)
+        while contents:
+            yield contents
+            contents = self.read(amt)
+
+
+class FakeAWS:
+    """
+    Answers STS, S3, DynamoDB, CloudWatch Logs, Firehose and SNS calls and counts them by operation.
+    S3 objects are served from memory or streamed from a file. A latency can be
+    added to every call to stand for the network round trip.
+    """
+
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self.objects = {}
+        # DynamoDB items written by batches, by (LogGroupName, LogStreamName)
+        self.items = {}
+        # content of the S3 objects put, by key
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def install(self):
+        boto3.setup_default_session()
+        boto3.DEFAULT_SESSION.events.register('before-send', self.respond)
+
+    def add_object(self, key, data=None, path=None):
+        self.objects[key] = (data, path)
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+
+    def respond(self, request, event_name, **kwargs):
+        operation = '.'.join(event_name.split('.')[1:])
+        with self.lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if operation == 'sts.GetCallerIdentity':
+            body = ('<GetCallerIdentityResponse><GetCallerIdentityResult>'
+                    '<Account>' + SECLOG_ACCOUNT + '</Account>'
+                    '<Arn>arn:aws:sts::' + SECLOG_ACCOUNT + ':assumed-role/benchmark/benchmark</Arn>'
+                    '<UserId>benchmark</UserId></GetCallerIdentityResult></GetCallerIdentityResponse>')
+            return AWSResponse(request.url, 200, {}, RawResponse(body.encode()))
+        if operation == 's3.GetObject':
+            path = urllib.parse.unquote(urllib.parse.urlsplit(request.url).path)
+            key = next(key for key in self.objects if path.endswith('/' + key))
+            data, filename = self.objects[key]
+            if filename is not None:
+                return AWSResponse(request.url, 200, {'Content-Length': str(os.path.getsize(filename)), 'ETag': '"etag"'},
+                                   RawFile(filename))
+            return AWSResponse(request.url, 200, {'Content-Length': str(len(data)), 'ETag': '"etag"'}, RawResponse(data))
+        if operation == 's3.PutObject':
+            url = urllib.parse.urlsplit(request.url)
+            key = urllib.parse.unquote(url.path)[1:]
+            if url.netloc.startswith(('s3.', 's3-')):
+                # path-style URL: /<bucket>/<key>
+                key = key.split('/', 1)[1]
+            self.uploads[key] = request.body.read() if hasattr(request.body, 'read') else request.body
+            return AWSResponse(request.url, 200, {'ETag': '"etag"'}, RawResponse(b''))
+        if operation == 'sns.Publish':
+            body = ('<PublishResponse><PublishResult><MessageId>benchmark</MessageId></PublishResult>'
+                    '<ResponseMetadata><RequestId>benchmark</RequestId></ResponseMetadata></PublishResponse>')
+            return AWSResponse(request.url, 200, {}, RawResponse(body.encode()))
+        if operation == 'dynamodb.BatchWriteItem':
+            for table, requests in json.loads(request.body)['RequestItems'].items():
+                for put in requests:
+                    item = put['PutRequest']['Item']
+                    self.items[(item['LogGroupName']['S'], item['LogStreamName']['S'])] = item
+            return AWSResponse(request.url, 200, {}, RawResponse(b'{"UnprocessedItems": {}}'))
+        if operation == 'dynamodb.BatchGetItem':
+            responses = {}
+            for table, keys in json.loads(request.body)['RequestItems'].items():
+                found = (self.items.get((key['LogGroupName']['S'], key['LogStreamName']['S'])) for key in keys['Keys'])
+                responses[table] = [item for item in found if item is not None]
+            body = {'Responses': responses, 'UnprocessedKeys': {}}
+            return AWSResponse(request.url, 200, {}, RawResponse(json.dumps(body).encode()))
+        if operation == 'firehose.PutRecordBatch':
+            records = len(json.loads(request.body)['Records'])
+            body = {'FailedPutCount': 0, 'Encrypted': False, 'RequestResponses': [{'RecordId': str(index)} for index in range(records)]}
+            return AWSResponse(request.url, 200, {}, RawResponse(json.dumps(body).encode()))
+        return AWSResponse(request.url, 200, {}, RawResponse(b'{}'))
+
+
+class Context:
+    """
+    The attributes of the Lambda context used by the shipper.
+    """
+    log_stream_name = log_group_name = aws_request_id = function_name = function_version = 'benchmark'
+    memory_limit_in_mb = 128
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+
+def s3_event(keys, bucket='cloudtrail-logs-' + SECLOG_ACCOUNT + '-do-not-delete', event_time='2024-01-01T00:00:00.000Z'):
+    """
+    Returns an S3 notification event for the given object keys.
+    """
+    return {'Records': [{
+        'eventSource': 'aws:s3',
+        'eventTime': event_time,
+        's3': {'bucket': {'name': bucket}, 'object': {'key': key, 'eTag': 'etag-' + key}},
+    } for key in keys]}
@@ -0,0 +1,175 @@
+"""
+Synthetic gzipped log files shaped like the ones CloudTrail, CloudTrail Insights
+and AWS Config deliver to the SecLog buckets. The files are written record by
+record, so large fixtures never have to fit in memory, and are reproducible for
+a given seed.
+"""
+import gzip
+import json
+import os
+import random
+import time
+import uuid
+
+from fake_aws import LINKED_ACCOUNT, REGION
+
+SOURCES = ('CloudTrail', 'CloudTrail-Insight', 'Config', 'Config-Snapshot')
+# Config-Snapshot: the items of a snapshot, captured over the last 30 days and not in time order,
+# some of them older than the 14 days PutLogEvents accepts
+SNAPSHOT_DAYS = 30
+API_CALLS = [
+    ('ec2.amazonaws.com', 'DescribeInstances'), ('ec2.amazonaws.com', 'RunInstances'),
+    ('s3.amazonaws.com', 'GetObject'), ('s3.amazonaws.com', 'PutObject'),
+    ('iam.amazonaws.com', 'GetRole'), ('iam.amazonaws.com', 'CreateAccessKey'),
+    ('sts.amazonaws.com', 'AssumeRole'), ('kms.amazonaws.com', 'Decrypt'),
+    ('signin.amazonaws.com', 'ConsoleLogin'), ('config.amazonaws.com', 'PutEvaluations'),
+]
+RESOURCE_TYPES = ['AWS::EC2::Instance', 'AWS::EC2::SecurityGroup', 'AWS::S3::Bucket', 'AWS::IAM::Role', 'AWS::KMS::Key']
+
+
+def object_key(source, records):
+    """
+    Returns the S3 key of the fixture, in the layout of the source.
+    """
+    return 'AWSLogs/%s/%s/%s/2024/01/01/%s_%s_%s_%d.json.gz' % (
+        LINKED_ACCOUNT, source.split('-Snapshot')[0], REGION, LINKED_ACCOUNT, source, REGION, records)
+
+
+def iso_time(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+def cloudtrail_record(rng, seconds):
+    event_source, event_name = rng.choice(API_CALLS)
+    record = {
+        'eventVersion': '1.08',
+        'userIdentity': {
+            'type': 'AssumedRole',
+            'principalId': 'AROAEXAMPLE%08d:session' % rng.randrange(10 ** 8),
+            'arn': 'arn:aws:sts::%s:assumed-role/role-%d/session' % (LINKED_ACCOUNT, rng.randrange(50)),
+            'accountId': LINKED_ACCOUNT,
+            'sessionContext': {'attributes': {'creationDate': iso_time(seconds - 600), 'mfaAuthenticated': 'false'}},
+        },
+        'eventTime': iso_time(seconds),
+        'eventSource': event_source,
+        'eventName': event_name,
+        'awsRegion': REGION,
+        'sourceIPAddress': '10.%d.%d.%d' % (rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+        'userAgent': 'aws-sdk-python/1.0 Python/3.9',
+        'requestParameters': {'resourceId': 'r-%016x' % rng.getrandbits(64), 'maxResults': rng.randrange(1000),
+                              'filter': ['tag:%d' % i for i in range(rng.randrange(8))]},
+        'responseElements': None,
+        'requestID': str(uuid.UUID(int=rng.getrandbits(128))),
+        'eventID': str(uuid.UUID(int=rng.getrandbits(128))),
+        'readOnly': event_name.startswith(('Describe', 'Get')),
+        'eventType': 'AwsApiCall',
+        'managementEvent': True,
+        'recipientAccountId': LINKED_ACCOUNT,
+        'eventCategory': 'Management',
+    }
+    if rng.random() < 0.05:
+        record['errorCode'] = 'AccessDenied'
+        record['errorMessage'] = 'User is not authorized to perform this operation'
+    return record
+
+
+def insight_record(rng, seconds):
+    event_source, event_name = rng.choice(API_CALLS)
+    return {
+        'eventVersion': '1.08',
+        'eventTime': iso_time(seconds),
+        'awsRegion': REGION,
+        'eventID': str(uuid.UUID(int=rng.getrandbits(128))),
+        'eventType': 'AwsCloudTrailInsight',
+        'recipientAccountId': LINKED_ACCOUNT,
+        'sharedEventID': str(uuid.UUID(int=rng.getrandbits(128))),
+        'insightDetails': {
+            'state': rng.choice(['Start', 'End']),
+            'eventSource': event_source,
+            'eventName': event_name,
+            'insightType': 'ApiCallRateInsight',
+            'insightContext': {'statistics': {
+                'baseline': {'average': round(rng.random(), 4)},
+                'insight': {'average': round(rng.random() * 100, 4)},
+                'insightDuration': rng.randrange(1, 60),
+            }},
+        },
+        'eventCategory': 'Insight',
+    }
+
+
+def config_record(rng, seconds):
+    resource_type = rng.choice(RESOURCE_TYPES)
+    resource_id = '%s-%016x' % (resource_type.split('::')[-1].lower(), rng.getrandbits(64))
+    return {
+        'relatedEvents': [],
+        'relationships': [{'resourceId': 'vpc-%08x' % rng.getrandbits(32), 'resourceType': 'AWS::EC2::VPC',
+                           'name': 'Is contained in Vpc'}],
+        'configuration': {
+            'resourceId': resource_id,
+            'tags': [{'key': 'tag-%d' % i, 'value': 'value-%d' % rng.randrange(1000)} for i in range(rng.randrange(10))],
+            'properties': {'property-%d' % i: 'x' * rng.randrange(64) for i in range(rng.randrange(20))},
+        },
+        'supplementaryConfiguration': {},
+        'tags': {},
+        'configurationItemVersion': '1.3',
+        'configurationItemCaptureTime': iso_time(seconds)[:-1] + '.000Z',
+        'configurationStateId': rng.getrandbits(40),
+        'awsAccountId': LINKED_ACCOUNT,
+        'configurationItemStatus': 'OK',
+        'resourceType': resource_type,
+        'resourceId': resource_id,
+        'ARN': 'arn:aws:config:%s:%s:%s/%s' % (REGION, LINKED_ACCOUNT, resource_type, resource_id),
+        'awsRegion': REGION,
+        'availabilityZone': 'Not Applicable',
+        'configurationStateMd5Hash': '',
+    }
+
+
+RECORD_BUILDERS = {
+    'CloudTrail': ('Records', cloudtrail_record, {}),
+    'CloudTrail-Insight': ('Records', insight_record, {}),
+    'Config': ('configurationItems', config_record, {'fileVersion': '1.0', 'configSnapshotId': 'benchmark'}),
+    'Config-Snapshot': ('configurationItems', config_record, {'fileVersion': '1.0', 'configSnapshotId': 'benchmark'}),
+}
+
+
+def write_fixture(path, source, records, seed=0, start=None):
+    """
+    Writes a gzipped log file of the source with the given number of records.
+    The records are spread over the hour before start (now by default), so that
+    PutLogEvents would accept them, except for Config-Snapshot whose records are
+    captured at random times of the SNAPSHOT_DAYS days before start.
+
+        :param path: The file to write.
+        :param source: CloudTrail, CloudTrail-Insight or Config.
+        :param records: The number of records.
+        :param seed: The seed of the generated values.
+        :param start: The epoch time in seconds of the most recent record.
+    """
+    field, build_record, header = RECORD_BUILDERS[source]
+    rng = random.Random(seed)
+    start = int(time.time()) if start is None else start
+    with gzip.open(path, 'wt', encoding='utf-8') as output:
+        output.write(json.dumps(header)[:-1] + (', ' if header else '') + json.dumps(field) + ': [')
+        for index in range(records):
+            if index:
+                output.write(', ')
+            if source == 'Config-Snapshot':
+                seconds = start - rng.randrange(SNAPSHOT_DAYS * 86400)
+            else:
+                seconds = start - 3600 + index * 3600 // records
+            output.write(json.dumps(build_record(rng, seconds)))
+        output.write(']}')
+
+
+def fixture(directory, source, records, seed=0):
+    """
+    Returns the path of the fixture of the source, writing it unless it was
+    written less than an hour ago (its records must stay in the accepted time range).
+    """
+    path = os.path.join(directory, '%s-%d-%d.json.gz' % (source, records, seed))
+    if not os.path.exists(path) or os.path.getmtime(path) < time.time() - 3000:
+        write_fixture(path + '.tmp', source, records, seed)
+        os.replace(path + '.tmp', path)
+    return path
@@ -452,8 +452,8 @@ configure_seclog() {
     CLOUDTRAIL_LAMBDA_CODE="CloudtrailLogShipper-$NOW.zip"
     CONFIG_LAMBDA_CODE="ConfigLogShipper-$NOW.zip"
 
-    zip -j $CLOUDTRAIL_LAMBDA_CODE LAMBDAS/CloudtrailLogShipper.py
-    zip -j $CONFIG_LAMBDA_CODE LAMBDAS/ConfigLogShipper.py
+    zip -j $CLOUDTRAIL_LAMBDA_CODE LAMBDAS/LogShipper.py
+    zip -j $CONFIG_LAMBDA_CODE LAMBDAS/LogShipper.py
 
     
     awk -v cl=$CLOUDTRAIL_LAMBDA_CODE -v co=$CONFIG_LAMBDA_CODE '{ sub(/##cloudtrailCodeURI##/,cl);gsub(/##configCodeURI##/,co);print }' $CFN_LAMBDAS_TEMPLATE > $LOGSHIPPER_TEMPLATE_WITH_CODE
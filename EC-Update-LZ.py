@@ -395,11 +395,11 @@ def main(argv):
                 now = datetime.now().strftime('%d%m%Y')
                 cloudtrail_lambda=f'CloudtrailLogShipper-{now}.zip'
                 with ZipFile(cloudtrail_lambda,'w') as zip:
-                    zip.write('LAMBDAS/CloudtrailLogShipper.py','CloudtrailLogShipper.py')
+                    zip.write('LAMBDAS/LogShipper.py','LogShipper.py')
 
                 config_lambda=f'ConfigLogShipper-{now}.zip'
                 with ZipFile(config_lambda,'w') as zip:
-                    zip.write('LAMBDAS/ConfigLogShipper.py','ConfigLogShipper.py')
+                    zip.write('LAMBDAS/LogShipper.py','LogShipper.py')
 
                 #update CFT file
                 if seclog_status != Execution.FAIL:
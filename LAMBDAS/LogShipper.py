@@ -0,0 +1,3124 @@
+import array
+import boto3
+import calendar
+import codecs
+import fnmatch
+import hashlib
+import zlib
+import re
+import json
+import os
+import logging
+import queue
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import urllib.parse
+from botocore.config import Config
+from botocore.exceptions import ClientError
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # optional, provided by a layer when the Parquet archive is enabled
+    pyarrow = None
+
+# initialise logger
+LOGGER = logging.getLogger()
+DYNAMODB_TABLE_NAME = 'SECLZSyncLogs'
+SEVEN_DAYS_IN_SECONDS = 604800
+# the ingestion ledger shares the table with the sequence tokens, under its own hash keys:
+# one per S3 object, the objects of the central buckets would otherwise share one partition
+CHECKPOINT_KEY_PREFIX = 'checkpoint#'
+CHECKPOINT_KEY_SEPARATOR = '#'
+# suppression window of the CIS alerts of each account and pattern
+ALERT_KEY_PREFIX = 'alert#'
+MAX_ITEMS_PER_BATCH = 10000
+ITEM_BYTES_OVERHEAD = 26
+MAX_BATCH_SISE = 1048576
+MAX_BATCH_SPAN_MILLIS = 24 * 3600 * 1000
+# larger log events are split into linked chunk events
+MAX_EVENT_SIZE = 262144
+MAX_EVENT_AGE_MILLIS = 14 * 24 * 3600 * 1000
+MAX_EVENT_FUTURE_MILLIS = 2 * 3600 * 1000
+# keeps the accepted range valid until the batch is actually sent
+EVENT_AGE_MARGIN_MILLIS = 5 * 60 * 1000
+MAX_TRY = 30
+DEADLINE_MARGIN_SECONDS = 5
+LAMBDA_TIMEOUT_SECONDS = 900
+# (base, cap) in seconds of the exponential backoff of each retried PutLogEvents error
+RETRY_POLICIES = {
+    'ResourceNotFoundException': (0.1, 2),
+    'InvalidSequenceTokenException': (0.05, 1),
+    'DataAlreadyAcceptedException': (0, 0),
+    'ThrottlingException': (0.5, 10),
+    'ServiceUnavailableException': (0.5, 10),
+    # Firehose PutRecordBatch
+    'InternalFailure': (0.5, 10),
+    # DynamoDB BatchGetItem/BatchWriteItem unprocessed keys
+    'UnprocessedKeys': (0.05, 2),
+}
+# Firehose PutRecordBatch limits, the records being newline-delimited
+MAX_FIREHOSE_RECORDS_PER_BATCH = 500
+MAX_FIREHOSE_BATCH_SIZE = 4194304
+MAX_FIREHOSE_RECORD_SIZE = 1024000
+FIREHOSE_RECORD_OVERHEAD = 1
+MAX_WORKERS = 4
+PIPELINE_DEPTH = 2
+MAX_POOL_CONNECTIONS = 16
+# clients are created once per container and reused by warm invocations
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+CLIENT_CONFIG = Config(max_pool_connections=MAX_POOL_CONNECTIONS, tcp_keepalive=True)
+# known streams per shard
+KNOWN_STREAMS_MAX_SIZE = 1024
+KNOWN_STREAMS_TTL_SECONDS = 3600
+# log streams known to exist, with their expiry time, least recently used first
+KNOWN_STREAMS = OrderedDict()
+KNOWN_STREAMS_LOCK = threading.Lock()
+# fingerprints of the last configuration item shipped for each resource
+DEDUP_KEY_PREFIX = 'dedup#'
+DEDUP_READ_BATCH_SIZE = 100
+DEDUP_WRITE_BATCH_SIZE = 25
+DEDUP_CACHE_MAX_SIZE = 65536
+DEDUP_CACHE_TTL_SECONDS = 3600
+# resource key: (fingerprint, expiry epoch time), least recently used first
+DEDUP_CACHE = OrderedDict()
+DEDUP_CACHE_LOCK = threading.Lock()
+# Parquet archive: a row group of CloudTrail records is a few MB once compressed,
+# large enough for the Athena scans and small enough for the memory of the function
+ARCHIVE_PREFIX = 'archive/'
+ARCHIVE_ROW_GROUP_ROWS = 32768
+# the compaction merges the files of the partitions of the last days into files of at most 4M rows
+ARCHIVE_COMPACT_DAYS = 2
+ARCHIVE_COMPACT_FILE_ROWS = 4194304
+ARCHIVE_COMPACTED_PREFIX = 'compacted-'
+# the manifest listing the files merged until they are all deleted, ignored by Athena like any file starting with _
+ARCHIVE_MANIFEST_PREFIX = '_compaction-'
+MAX_DELETE_OBJECTS = 1000
+# buffered rows are converted to Arrow arrays by chunks, more compact than Python strings
+ARCHIVE_CHUNK_ROWS = 4096
+ARCHIVE_COMPRESSION = 'snappy'
+ARCHIVE_DIRECTORY = '/tmp'
+ARCHIVE_OTHER_FIELDS = 'otherFields'
+# separators of the messages when the filter rules ask for compact JSON
+COMPACT_SEPARATORS = (',', ':')
+FILTER_ACTIONS = ('drop', 'remove', 'truncate')
+# encodes the nested values of the archive without the set up of json.dumps at each call
+ARCHIVE_ENCODER = json.JSONEncoder(separators=COMPACT_SEPARATORS)
+# separates the base name of a log stream from its shard number
+SHARD_SEPARATOR = '#'
+# set once a tokenless PutLogEvents call has been rejected by the endpoint
+SEQUENCE_TOKEN_REQUIRED = False
+# the account the shipper runs in, resolved once per container
+SECLOG_ACCOUNT_ID = None
+TIMESTAMP_CACHE_SIZE = 4096
+READ_CHUNK_SIZE = 65536
+GZIP_WBITS = zlib.MAX_WBITS | 16
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+METRICS_NAMESPACE = 'SECLZ/LogShipper'
+# an embedded metric format value list holds at most 100 values
+MAX_EMF_VALUES = 100
+METRIC_UNITS = OrderedDict([
+    ('Objects', 'Count'),
+    ('Records', 'Count'),
+    ('CompressedBytes', 'Bytes'),
+    ('DecompressedBytes', 'Bytes'),
+    ('Batches', 'Count'),
+    ('BatchFillRatio', 'None'),
+    ('OverflowRecords', 'Count'),
+    ('SplitRecords', 'Count'),
+    ('FilteredEvents', 'Count'),
+    ('FilteredBytes', 'Bytes'),
+    ('DetectedEvents', 'Count'),
+    ('DedupSkipped', 'Count'),
+    ('DedupShipped', 'Count'),
+    ('ArchivedRecords', 'Count'),
+    ('ArchivedBytes', 'Bytes'),
+    ('ArchiveFailures', 'Count'),
+    ('DynamoDBCalls', 'Count'),
+    ('FailedStreams', 'Count'),
+    ('IngestionLag', 'Milliseconds'),
+    ('DownloadTime', 'Milliseconds'),
+    ('DecompressTime', 'Milliseconds'),
+    ('ParseTime', 'Milliseconds'),
+    ('PutTime', 'Milliseconds'),
+    ('ArchiveTime', 'Milliseconds'),
+])
+# metrics of the optional features, declared when the feature is enabled or when they are not zero
+FEATURE_METRICS = {
+    'FilteredEvents': 'FilterRules',
+    'FilteredBytes': 'FilterRules',
+    'DetectedEvents': 'CisDetection',
+    'DedupSkipped': 'ConfigDedup',
+    'DedupShipped': 'ConfigDedup',
+    'ArchivedRecords': 'Archive',
+    'ArchivedBytes': 'Archive',
+    'ArchiveFailures': 'Archive',
+    'ArchiveTime': 'Archive',
+}
+# dimensions of the API call counters of the activity aggregation
+ACTIVITY_DIMENSIONS = [['Account', 'Region', 'EventSource', 'EventName', 'ErrorCode'], ['Account', 'ErrorCode']]
+# events described in each CIS alert
+MAX_ALERT_SAMPLES = 10
+# three periods of the CIS alarms: CloudTrail delivers its files about every 5 minutes
+ALERT_SUPPRESSION_SECONDS = 900
+# metrics of the log stream shipped by the current thread
+CURRENT_METRICS = threading.local()
+
+
+class SourceAdapter:
+    """
+    This class describes a source of log files: the S3 keys it handles, where the
+    records are in a file, their timestamp and the log group they are shipped to.
+    """
+
+    def __init__(self, name, key_pattern, records_field, stream_label, log_group_variable, default_log_group,
+                 timestamp_field=None, excluded_keys=(), identity_fields=(), api_calls=False,
+                 dedup_key_fields=(), volatile_fields=(), archive_columns=()):
+        """
+            :param name: The name of the source, as listed in LOG_SOURCES.
+            :param key_pattern: The regexp the S3 keys of the source match.
+            :param records_field: The top-level key of the array of records in a file.
+            :param stream_label: The label of the log streams: <account>_<label>_<region>.
+            :param log_group_variable: The environment variable holding the log group name.
+            :param default_log_group: The log group name when the variable is not set.
+            :param timestamp_field: The record field holding its timestamp, None to use the S3 event time.
+            :param excluded_keys: Substrings of the S3 keys of the source that are not shipped.
+            :param identity_fields: The record fields copied to each chunk of a split record.
+            :param api_calls: Whether the records are CloudTrail API calls, for the activity aggregation and the CIS detection.
+            :param dedup_key_fields: The record fields identifying the resource a record describes, for the deduplication.
+            :param volatile_fields: The record fields left out of the fingerprint of a record.
+            :param archive_columns: The record fields stored as columns of the Parquet archive.
+        """
+        self.name = name
+        self.key_pattern = re.compile(key_pattern)
+        self.records_field = records_field
+        self.stream_label = stream_label
+        self.log_group_variable = log_group_variable
+        self.default_log_group = default_log_group
+        self.timestamp_field = timestamp_field
+        self.excluded_keys = excluded_keys
+        self.identity_fields = identity_fields
+        self.api_calls = api_calls
+        self.dedup_key_fields = dedup_key_fields
+        self.volatile_fields = volatile_fields
+        self.archive_columns = archive_columns
+        self.log_group_name = None
+
+    def matches(self, filename):
+        """
+        This function tells if the S3 object belongs to the source.
+
+            :param filename: The key of the S3 object.
+        """
+        return self.key_pattern.match(filename) is not None and not any(key in filename for key in self.excluded_keys)
+
+    def log_group(self):
+        """
+        This function gets the log group of the source from the environment variables table.
+        """
+        if self.log_group_name is None:
+            self.log_group_name = os.environ.get(self.log_group_variable, self.default_log_group)
+        return self.log_group_name
+
+    def log_stream(self, filename):
+        """
+        This function returns the log stream of an S3 object: <account>_<label>_<region>,
+        followed by #<shard> when the object falls in a shard other than the first one.
+
+            :param filename: The key of the S3 object (AWSLogs/<account>/<source>/<region>/...).
+        """
+        l = filename.split('/')
+        log_stream = l[1] + '_' + self.stream_label + '_' + l[3]
+        shard = log_stream_shard(filename)
+        if shard:
+            log_stream += SHARD_SEPARATOR + str(shard)
+        return log_stream
+
+    def timestamp(self, record, event_timestamp):
+        """
+        This function returns the timestamp of the log event of a record in milliseconds:
+        the one of the record, or the time of the S3 event when the record has none.
+
+            :param record: The record read from the S3 object.
+            :param event_timestamp: The time of the S3 event in milliseconds.
+        """
+        if self.timestamp_field is None or not record.get(self.timestamp_field):
+            return event_timestamp
+        return to_epoch_millis(record[self.timestamp_field])
+
+    def identity(self, record):
+        """
+        This function returns the fields identifying a record, repeated in its chunks when it is split.
+
+            :param record: The record read from the S3 object.
+        """
+        return OrderedDict((field, record[field]) for field in self.identity_fields if field in record)
+
+    def dedup_key(self, record):
+        """
+        This function returns the (LogGroupName, LogStreamName) key of the fingerprint of the
+        resource the record describes: the first two key fields make the partition, the others
+        the sort key. It returns None when a key field is missing.
+
+            :param record: The record read from the S3 object.
+        """
+        values = [record.get(field) for field in self.dedup_key_fields]
+        if len(values) < 3 or not all(isinstance(value, str) and value for value in values):
+            return None
+        return DEDUP_KEY_PREFIX + SHARD_SEPARATOR.join(values[:2]), SHARD_SEPARATOR.join(values[2:])
+
+    def fingerprint(self, record):
+        """
+        This function returns the hash of the content of the record, its volatile fields excluded.
+
+            :param record: The record read from the S3 object.
+        """
+        content = {field: value for field, value in record.items() if field not in self.volatile_fields}
+        return hashlib.sha256(json.dumps(content, sort_keys=True, separators=COMPACT_SEPARATORS).encode('utf-8')).hexdigest()[:32]
+
+SOURCE_ADAPTERS = [
+    SourceAdapter('CloudTrail', r'AWSLogs/\d+/CloudTrail/', 'Records', 'CloudTrail',
+                  'CLOUDTRAIL_LOG_GROUP', '/aws/cloudtrail', timestamp_field='eventTime',
+                  identity_fields=('eventID', 'eventTime', 'eventSource', 'eventName', 'recipientAccountId'),
+                  api_calls=True,
+                  archive_columns=('eventVersion', 'eventTime', 'eventSource', 'eventName', 'awsRegion', 'sourceIPAddress',
+                                   'userAgent', 'errorCode', 'errorMessage', 'requestID', 'eventID', 'eventType',
+                                   'eventCategory', 'readOnly', 'managementEvent', 'recipientAccountId', 'sharedEventID',
+                                   'vpcEndpointId', 'userIdentity', 'requestParameters', 'responseElements',
+                                   'additionalEventData', 'resources', 'tlsDetails')),
+    SourceAdapter('CloudTrail-Insight', r'AWSLogs/\d+/CloudTrail-Insight/', 'Records', 'CloudTrail',
+                  'INSIGHT_LOG_GROUP', '/aws/cloudtrail/insight', timestamp_field='eventTime',
+                  identity_fields=('eventID', 'eventTime', 'recipientAccountId'),
+                  archive_columns=('eventVersion', 'eventTime', 'awsRegion', 'eventID', 'eventType', 'eventCategory',
+                                   'recipientAccountId', 'sharedEventID', 'insightDetails')),
+    SourceAdapter('Config', r'AWSLogs/\d+/Config/', 'configurationItems', 'Config',
+                  'CONFIG_LOG_GROUP', '/aws/events/config', timestamp_field='configurationItemCaptureTime',
+                  excluded_keys=('ConfigWritabilityCheckFile',),
+                  identity_fields=('ARN', 'resourceType', 'resourceId', 'awsAccountId', 'awsRegion',
+                                   'configurationItemCaptureTime', 'configurationStateId'),
+                  dedup_key_fields=('awsAccountId', 'awsRegion', 'resourceType', 'resourceId'),
+                  volatile_fields=('configurationItemCaptureTime', 'configurationStateId', 'configurationItemMD5Hash',
+                                   'configurationStateMd5Hash'),
+                  archive_columns=('configurationItemVersion', 'configurationItemCaptureTime', 'configurationStateId',
+                                   'awsAccountId', 'configurationItemStatus', 'resourceType', 'resourceId', 'resourceName',
+                                   'ARN', 'awsRegion', 'availabilityZone', 'resourceCreationTime', 'tags', 'relationships',
+                                   'configuration', 'supplementaryConfiguration')),
+]
+
+def lambda_handler(event, context):
+  start_time = time.perf_counter()
+  deadline = get_deadline(context)
+  LOGGER.setLevel(check_log_level())
+  LOGGER.debug('Lambda invoked')
+  LOGGER.debug('Event: %s', event)
+  LOGGER.debug("Log stream name: %s", context.log_stream_name)
+  LOGGER.debug("Log group name: %s", context.log_group_name)
+  LOGGER.debug("Request ID: %s", context.aws_request_id)
+  LOGGER.debug("Mem. limits(MB): %s", context.memory_limit_in_mb)
+  LOGGER.debug("Function name: %s", context.function_name)
+  LOGGER.debug("Function version: %s", context.function_version)
+  seclog_account = get_seclog_account()
+  # S3 objects grouped by destination log stream, in the order of the event
+  objects_by_stream = OrderedDict()
+  # SQS messages the S3 objects of each log stream come from (SQS ingestion mode)
+  messages_by_stream = {}
+  is_sqs = is_sqs_event(event)
+  adapters = get_source_adapters()
+  for record, message_id in get_s3_records(event):
+    filename = urllib.parse.unquote(record['s3']['object']['key'])
+    adapter = next((adapter for adapter in adapters if adapter.matches(filename)), None)
+    if not seclog_account in filename and adapter is not None:
+        LOGGER.info(adapter.name + ' S3 object matching regexp detected: ' + filename)
+        loggroup = adapter.log_group()
+        bucketname = record['s3']['bucket']['name']
+        LOGGER.debug('S3 bucket: ' + bucketname)
+        logstreamname = adapter.log_stream(filename)
+        LOGGER.debug('logstreamname: : ' + logstreamname)
+        LOGGER.debug('Linked account: : ' + filename.split('/')[1])
+        etag = record['s3']['object'].get('eTag', '')
+        ts = to_epoch_millis(record['eventTime'])
+        objects_by_stream.setdefault((loggroup, logstreamname), []).append((adapter, bucketname, filename, etag, ts))
+        messages_by_stream.setdefault((loggroup, logstreamname), set()).add(message_id)
+    else:
+        LOGGER.info("S3 object Skipped: "+ seclog_account+" is in "+filename)
+  metrics_by_stream = OrderedDict(((loggroup, logstreamname), ShippingMetrics(objects[0][0].name, objects[0][2].split('/')[1]))
+                                  for (loggroup, logstreamname), objects in objects_by_stream.items())
+  failures = ship_streams(objects_by_stream, deadline, metrics_by_stream)
+  publish_alerts(metrics_by_stream.values())
+  emit_metrics(metrics_by_stream.values())
+  LOGGER.info('Invocation processed in %.1f ms', (time.perf_counter() - start_time) * 1000)
+  if is_sqs:
+      # partial batch response: only the messages of the failed log streams are redelivered
+      failed_messages = sorted(set().union(*[messages_by_stream[key] for key in failures]))
+      return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_messages]}
+  if failures:
+      raise next(iter(failures.values()))
+
+
+def log_stream_shard(filename):
+    """
+    This function returns the shard of the log stream an S3 object is shipped to, among the
+    LOG_STREAM_SHARDS log streams of its account, source and region. The shard is a stable
+    hash of the key, so every invocation and every redelivery picks the same one. Shard 0
+    is the log stream used without sharding, the subscription filters being set on the
+    log groups they all belong to.
+
+        :param filename: The key of the S3 object.
+    """
+    shards = get_log_stream_shards()
+    if shards <= 1:
+        return 0
+    return zlib.crc32(filename.encode('utf-8')) % shards
+
+def is_sqs_event(event):
+    """
+    This function tells if the function has been invoked with SQS messages (SQS ingestion mode).
+
+        :param event: The event of the invocation.
+    """
+    return any(record.get('eventSource') == 'aws:sqs' for record in event['Records'])
+
+def get_s3_records(event):
+    """
+    This function returns the S3 records of the event, each with the id of the SQS
+    message it comes from, or None when the function is notified directly by S3.
+
+        :param event: The event of the invocation.
+    """
+    s3_records = []
+    for record in event['Records']:
+        if record.get('eventSource') != 'aws:sqs':
+            s3_records.append((record, None))
+            continue
+        try:
+            body = json.loads(record['body'])
+        except ValueError:
+            LOGGER.error('SQS message skipped, the body is not an S3 notification: ' + record['messageId'])
+            continue
+        # s3:TestEvent messages have no records
+        for s3_record in body.get('Records', []):
+            s3_records.append((s3_record, record['messageId']))
+    return s3_records
+
+def ship_streams(objects_by_stream, deadline, metrics_by_stream):
+    """
+    This function ships the S3 objects grouped by log stream. The log streams are
+    processed in parallel on a bounded thread pool, the objects of a log stream in order.
+    It returns the error of each log stream that could not be shipped.
+
+        :param objects_by_stream: The S3 objects to ship, grouped by (log group, log stream).
+        :param deadline: The time.monotonic() value after which no retry is attempted.
+        :param metrics_by_stream: The metrics of each log stream.
+    """
+    failures = OrderedDict()
+    max_workers = min(get_max_workers(), len(objects_by_stream))
+    if max_workers <= 1:
+        for (log_group_name, log_stream), objects in objects_by_stream.items():
+            try:
+                ship_stream(log_group_name, log_stream, objects, deadline, metrics_by_stream[(log_group_name, log_stream)])
+            except Exception as exception:
+                failures[(log_group_name, log_stream)] = exception
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = OrderedDict(((log_group_name, log_stream), executor.submit(ship_stream, log_group_name, log_stream, objects, deadline,
+                                                                                            metrics_by_stream[(log_group_name, log_stream)]))
+                                  for (log_group_name, log_stream), objects in objects_by_stream.items())
+        for key, future in futures.items():
+            if future.exception() is not None:
+                failures[key] = future.exception()
+    for (log_group_name, log_stream), exception in failures.items():
+        LOGGER.error('Log stream ' + log_stream + ' not shipped: ' + str(exception))
+        metrics_by_stream[(log_group_name, log_stream)].add('FailedStreams')
+    return failures
+
+def ship_stream(log_group_name, log_stream, objects, deadline, metrics):
+    """
+    This function ships in order the S3 objects bound to a log stream. The records
+    of consecutive objects share the same batches.
+
+        :param log_group_name: The name of the log group.
+        :param log_stream: The name of the log stream.
+        :param objects: The S3 objects to ship.
+        :param deadline: The time.monotonic() value after which no retry is attempted.
+        :param metrics: The metrics of the log stream.
+    """
+    sink = get_output_sink()
+    with metrics:
+        # Create the logstream if needed
+        sink.prepare(log_group_name, log_stream)
+        batch = sink.batch_builder()
+        total_counter = 0
+        adapter = objects[0][0]
+        deduplicator = ConfigDeduplicator(adapter, get_dedup_ttl()) if adapter.dedup_key_fields and deduplicate_config() else None
+        archive = ParquetArchive(adapter, log_stream, get_archive_bucket(), get_archive_prefix(),
+                                 get_archive_row_group_rows()) if adapter.archive_columns and archive_records() else None
+        try:
+            with BatchUploader(log_group_name, log_stream, deadline, metrics=metrics, sink=sink) as uploader:
+                for s3_object in objects:
+                    total_counter += ship_s3_object(uploader, batch, *s3_object, deduplicator=deduplicator, archive=archive)
+
+                # write the remaining items into cloudwatch log stream and complete the checkpoints
+                for log_events in batch.flush():
+                    uploader.submit(log_events)
+                uploader.advance(None)
+        finally:
+            # when the log stream fails, the records up to the saved checkpoints are counted
+            # and archived, the redelivery resumes from there
+            metrics.commit_activity()
+            if archive is not None:
+                archive.close()
+        if deduplicator is not None:
+            deduplicator.commit()
+
+    metrics.add('Batches', uploader.batch_counter)
+    metrics.add('OverflowRecords', batch.overflow_counter)
+    metrics.add('SplitRecords', batch.split_counter)
+    metrics.fill_ratios.extend(batch.fill_ratios)
+    if batch.overflow_counter > 0:
+        LOGGER.warning(str(batch.overflow_counter) + ' log entries out of the accepted time range stamped with the shipping time')
+    if batch.split_counter > 0:
+        LOGGER.warning(str(batch.split_counter) + ' log entries larger than ' + str(batch.max_event_size) + ' bytes split into chunk events')
+    if deduplicator is not None:
+        metrics.add('DedupSkipped', deduplicator.skipped_counter)
+        metrics.add('DedupShipped', deduplicator.shipped_counter)
+        LOGGER.info(str(deduplicator.skipped_counter) + ' log entries unchanged since last shipped skipped, '
+                    + str(deduplicator.shipped_counter) + ' shipped')
+    LOGGER.info(str(total_counter) + ' log entries from ' + str(len(objects)) + ' S3 object created in ' + str(uploader.batch_counter) + ' batch')
+
+def ship_s3_object(uploader, batch, adapter, bucketname, filename, etag, event_timestamp, deduplicator=None, archive=None):
+    """
+    This function ships the records of an S3 object to the log stream.
+
+        :param uploader: The uploader of the log stream.
+        :param batch: The batch being built for the log stream.
+        :param adapter: The source adapter of the S3 object.
+        :param bucketname: The name of the S3 bucket.
+        :param filename: The key of the S3 object.
+        :param etag: The ETag of the S3 object given by the S3 event.
+        :param event_timestamp: The time of the S3 event in milliseconds.
+        :param deduplicator: The deduplicator skipping the unchanged records, None to ship them all.
+        :param archive: The Parquet archive of the log stream, None when the records are not archived.
+    """
+    # skip the objects already shipped, or being shipped by another invocation
+    checkpoint = ObjectCheckpoint(bucketname, filename, etag)
+    if not checkpoint.claim(uploader.claim_expiry()):
+        LOGGER.info('S3 object skipped, already shipped or being shipped: ' + filename)
+        return 0
+    uploader.checkpoints.append(checkpoint)
+    shipped_counter = checkpoint.record_index
+
+    # get the object
+    metrics = current_metrics()
+    start = time.perf_counter()
+    obj = get_client('s3').get_object(Bucket=bucketname, Key=filename)
+    metrics.add_time('DownloadTime', start)
+    metrics.add('CompressedBytes', obj.get('ContentLength', 0))
+    LOGGER.debug('Retrieve S3 object')
+    # stream the content: decompress it by chunks and decode the records one at a time
+    records = metrics.timed(iter_json_array(iter_decompressed(obj['Body']), adapter.records_field), 'ParseTime')
+
+    # Write a batch of records into cloudwatch log stream:
+    # The maximum batch size is 1,048,576 bytes.
+    # This size is calculated as the sum of all event messages in UTF-8,
+    # plus 26 bytes for each log event.
+    # The maximum number of log events in a batch is 10,000.
+    # items in the batch must be in a chronological order and span at most 24 hours
+    total_counter = 0
+    rules = get_filter_rules()
+    aggregated = adapter.api_calls and aggregate_activity()
+    detection = get_detection_engine() if adapter.api_calls else None
+
+    indexed_records = ((record_index, record) for record_index, record in enumerate(records) if record_index >= shipped_counter)
+    if archive is not None:
+        # the archive keeps every record read, before the deduplication and the filter rules
+        indexed_records = archive.collect(indexed_records, checkpoint, bucketname, filename, event_timestamp)
+    if deduplicator is not None:
+        skipped_counter = deduplicator.skipped_counter
+        indexed_records = deduplicator.filter(indexed_records)
+
+    for record_index, record in indexed_records:
+        total_counter += 1
+        # get the timestamp of the log from the record (or the S3 event, depending on the source)
+        ts = adapter.timestamp(record, event_timestamp)
+        if aggregated:
+            metrics.count_activity(record, checkpoint, record_index)
+        if detection is not None:
+            for pattern in detection.detect(record):
+                metrics.add_detection(pattern, record)
+        if rules.active:
+            record = rules.apply(adapter.name, record, metrics)
+            if record is None:
+                continue
+
+        full_batches = batch.add(ts, record, adapter, (checkpoint, record_index))
+        for log_events in full_batches:
+            uploader.submit(log_events)
+        if full_batches:
+            # once these batches are uploaded, the records before the oldest one still buffered are shipped
+            uploader.advance(batch.oldest_mark())
+
+    if deduplicator is not None:
+        # the unchanged records are read, not shipped
+        total_counter += deduplicator.skipped_counter - skipped_counter
+    uploader.complete(checkpoint)
+    metrics.add('Objects')
+    metrics.add('Records', total_counter)
+    metrics.maximum('IngestionLag', int(time.time() * 1000) - event_timestamp)
+    LOGGER.debug(str(total_counter) + ' log entries read from S3 object ' + filename)
+    return total_counter
+
+class BatchBuilder:
+    """
+    This class accumulates log events up to the PutLogEvents limits. Each record
+    is serialized only once and accounted with its exact UTF-8 size, and the events
+    of a batch are sorted once, when it is completed. A batch never spans more than
+    24 hours: one batch is kept open per 24 hours window of the event timestamps, so
+    records arriving out of order (e.g. the items of a Config snapshot) still fill
+    full batches. Events PutLogEvents would reject as too old or too far in the future
+    go to the overflow path: they are stamped with the shipping time, their message
+    unchanged. Records larger than a log event are split into linked chunk events (see
+    split_message). The limits are those of the output sink, the time constraints only
+    apply to CloudWatch Logs.
+    """
+
+    def __init__(self, max_items=MAX_ITEMS_PER_BATCH, max_bytes=MAX_BATCH_SISE, overhead=ITEM_BYTES_OVERHEAD,
+                 max_event_size=MAX_EVENT_SIZE, time_bounded=True):
+        """
+            :param max_items: The maximum number of log events in a batch.
+            :param max_bytes: The maximum size of a batch, including the per event overhead.
+            :param overhead: The bytes counted for each log event on top of its message.
+            :param max_event_size: The maximum size of a log event, including the overhead.
+            :param time_bounded: Whether the span of a batch and the age of its events are limited.
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.overhead = overhead
+        self.max_event_size = max_event_size
+        self.time_bounded = time_bounded
+        self.separators = COMPACT_SEPARATORS if get_filter_rules().compact else None
+        # open batches by 24 hours window: [log events, size in bytes, sequence and mark of the first event]
+        # the accepted time range spans 15 windows at most, which bounds the memory used
+        self.batches = OrderedDict()
+        self.sequence = 0
+        self.overflow_counter = 0
+        self.split_counter = 0
+        # max(events / max_items, bytes / max_bytes) of each completed batch
+        self.fill_ratios = []
+
+    def __len__(self):
+        return sum(len(batch[0]) for batch in self.batches.values())
+
+    def add(self, timestamp, record, adapter=None, mark=None):
+        """
+        This function serializes the record and appends it to the batch of its window, as
+        chunk events when it is too large for a single log event. It returns the batches
+        completed because the record did not fit in them: usually none, or one.
+
+            :param timestamp: The timestamp of the log event in milliseconds.
+            :param record: The record to serialize as the message of the log event.
+            :param adapter: The source adapter of the record, giving the identity of its chunks.
+            :param mark: The position of the record, returned by oldest_mark() while it is buffered.
+        """
+        message = json.dumps(record, separators=self.separators)
+        event_size = event_size_bytes(message, self.overhead)
+        if self.time_bounded:
+            timestamp = self.accepted_timestamp(timestamp)
+        if event_size <= self.max_event_size:
+            full_batch = self.append(timestamp, message, event_size, mark)
+            return (full_batch,) if full_batch is not None else ()
+        self.split_counter += 1
+        identity = adapter.identity(record) if adapter is not None else OrderedDict()
+        full_batches = []
+        for chunk in split_message(message, identity, self.max_event_size, self.overhead):
+            full_batch = self.append(timestamp, chunk, event_size_bytes(chunk, self.overhead), mark)
+            if full_batch is not None:
+                full_batches.append(full_batch)
+        return full_batches
+
+    def append(self, timestamp, message, event_size, mark=None):
+        """
+        This function appends a log event to the batch of its window.
+        It returns the completed batch when the event does not fit in it, None otherwise.
+
+            :param timestamp: The accepted timestamp of the log event in milliseconds.
+            :param message: The message of the log event.
+            :param event_size: The size of the log event.
+            :param mark: The position of the record of the event.
+        """
+        window = timestamp // MAX_BATCH_SPAN_MILLIS if self.time_bounded else 0
+        full_batch = None
+        batch = self.batches.get(window)
+        if batch is not None and (len(batch[0]) >= self.max_items or batch[1] + event_size > self.max_bytes):
+            full_batch = self.close(window)
+            batch = None
+        if batch is None:
+            batch = self.batches[window] = [[], 0, self.sequence, mark]
+        self.sequence += 1
+        batch[0].append({'timestamp': timestamp, 'message': message})
+        batch[1] += event_size
+        return full_batch
+
+    def accepted_timestamp(self, timestamp):
+        """
+        This function returns the timestamp if PutLogEvents accepts it, the current time otherwise.
+
+            :param timestamp: The timestamp of the log event in milliseconds.
+        """
+        now = int(time.time() * 1000)
+        if now - MAX_EVENT_AGE_MILLIS + EVENT_AGE_MARGIN_MILLIS <= timestamp <= now + MAX_EVENT_FUTURE_MILLIS - EVENT_AGE_MARGIN_MILLIS:
+            return timestamp
+        self.overflow_counter += 1
+        return now
+
+    def oldest_mark(self):
+        """
+        This function returns the mark of the oldest event still buffered, None when the batches are empty.
+        """
+        if not self.batches:
+            return None
+        return min(self.batches.values(), key=itemgetter(2))[3]
+
+    def close(self, window):
+        """
+        This function removes the batch of the window and returns its log events in chronological order.
+
+            :param window: The 24 hours window of the batch.
+        """
+        log_events, size_bytes, _, _ = self.batches.pop(window)
+        self.fill_ratios.append(max(len(log_events) / self.max_items, size_bytes / self.max_bytes))
+        log_events.sort(key=itemgetter('timestamp'))
+        return log_events
+
+    def flush(self):
+        """
+        This function returns the log events of every open batch, one list per batch, and empties them.
+        """
+        return [self.close(window) for window in list(self.batches)]
+
+
+class ObjectCheckpoint:
+    """
+    This class is the entry of an S3 object version in the ingestion ledger kept in
+    the DynamoDB table. An attempt claims the object before downloading it, saves
+    how many records have been shipped at batch boundaries and marks the object as
+    shipped at the end. Objects already shipped are skipped, a redelivered event for
+    an interrupted attempt resumes from the saved record count once the claim of
+    that attempt has expired or been released.
+    """
+
+    def __init__(self, bucketname, filename, etag):
+        """
+            :param bucketname: The name of the S3 bucket.
+            :param filename: The key of the S3 object.
+            :param etag: The ETag of the S3 object version being shipped.
+        """
+        self.bucketname = bucketname
+        self.filename = filename
+        self.etag = etag
+        self.record_index = 0
+        self.shipped = False
+
+    def key(self):
+        return {
+            'LogGroupName': {'S': CHECKPOINT_KEY_PREFIX + self.bucketname + CHECKPOINT_KEY_SEPARATOR + self.filename},
+            'LogStreamName': {'S': self.filename}
+        }
+
+    def claim(self, claim_expiry):
+        """
+        This function claims the object for this attempt with a conditional write.
+        It returns False when the object has already been shipped or is claimed by
+        another attempt, True otherwise with record_index set to the records already shipped.
+
+            :param claim_expiry: The epoch time in seconds after which the claim can be taken over.
+        """
+        now = int(time.time())
+        values = {
+            ':etag': {'S': self.etag},
+            ':claimed': {'S': 'CLAIMED'},
+            ':expiry': {'N': str(int(claim_expiry))},
+            ':ttl': {'N': str(now + SEVEN_DAYS_IN_SECONDS)},
+        }
+        # a new object, or a new version of it whose records shipped of the previous version are forgotten
+        if self.update_claim('REMOVE RecordIndex', 'attribute_not_exists(LogGroupName) OR ETag <> :etag', values) is not None:
+            return True
+        # the same version again, claimable when the previous attempt has not shipped it
+        values.update({':released': {'S': 'RELEASED'}, ':now': {'N': str(now)}})
+        item = self.update_claim('', 'ETag = :etag AND (attribute_not_exists(#status) OR #status = :released'
+                                     ' OR (#status = :claimed AND ClaimExpiry < :now))', values)
+        if item is None:
+            return False
+        if 'RecordIndex' in item:
+            self.record_index = int(item['RecordIndex']['N'])
+            LOGGER.info('Resuming S3 object ' + self.filename + ' after ' + str(self.record_index) + ' records')
+        return True
+
+    def update_claim(self, remove_expression, condition_expression, values):
+        """
+        This function writes the claim if the condition holds. It returns the previous
+        attributes of the entry, None when the condition does not hold.
+
+            :param remove_expression: The REMOVE clause of the update, empty for none.
+            :param condition_expression: The condition of the claim.
+            :param values: The values of the expressions.
+        """
+        try:
+            response = get_client('dynamodb').update_item(
+                TableName=DYNAMODB_TABLE_NAME,
+                Key=self.key(),
+                UpdateExpression=('SET ETag = :etag, #status = :claimed, ClaimExpiry = :expiry, #ttl = :ttl '
+                                  + remove_expression).strip(),
+                ConditionExpression=condition_expression,
+                ExpressionAttributeNames={'#status': 'Status', '#ttl': 'TTL'},
+                ExpressionAttributeValues=values,
+                ReturnValues='ALL_OLD'
+            )
+        except ClientError as client_error:
+            if client_error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+        return response.get('Attributes', {})
+
+    def is_saved(self, record_index):
+        """
+        This function tells if the record is shipped for good: a redelivery after a failure
+        resumes from the saved record count and does not read it again.
+
+            :param record_index: The index of the record in the object.
+        """
+        return self.shipped or record_index < self.record_index
+
+    def save(self, record_index):
+        """
+        This function saves the number of records shipped.
+
+            :param record_index: The number of records of the object already shipped.
+        """
+        get_client('dynamodb').update_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key=self.key(),
+            UpdateExpression='SET RecordIndex = :index',
+            ExpressionAttributeValues={':index': {'N': str(record_index)}}
+        )
+        self.record_index = record_index
+
+    def complete(self):
+        """
+        This function marks the object as shipped once all its records have been uploaded.
+        """
+        get_client('dynamodb').update_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key=self.key(),
+            UpdateExpression='SET #status = :shipped REMOVE ClaimExpiry, RecordIndex',
+            ExpressionAttributeNames={'#status': 'Status'},
+            ExpressionAttributeValues={':shipped': {'S': 'SHIPPED'}}
+        )
+        self.shipped = True
+
+    def release(self):
+        """
+        This function gives up the claim after a failure, so a redelivery can resume at once.
+        """
+        try:
+            get_client('dynamodb').update_item(
+                TableName=DYNAMODB_TABLE_NAME,
+                Key=self.key(),
+                UpdateExpression='SET #status = :released REMOVE ClaimExpiry',
+                ExpressionAttributeNames={'#status': 'Status'},
+                ExpressionAttributeValues={':released': {'S': 'RELEASED'}}
+            )
+        except Exception:
+            LOGGER.exception('Unable to release the claim on S3 object ' + self.filename)
+
+class ConfigDeduplicator:
+    """
+    This class skips the records identical to the last version shipped of the resource
+    they describe. The fingerprint of that version is kept in the DynamoDB table, with a
+    TTL after which the resource is shipped again even if unchanged, and in a cache of the
+    warm container in front of it. The fingerprints of the records of a log stream are
+    only written once the log stream has been shipped: a failed attempt ships them again.
+    """
+
+    def __init__(self, adapter, ttl):
+        """
+            :param adapter: The source adapter of the records.
+            :param ttl: The seconds during which an unchanged record is not shipped again.
+        """
+        self.adapter = adapter
+        self.ttl = ttl
+        # resource key: fingerprint of the records shipped and not committed yet
+        self.pending = OrderedDict()
+        self.skipped_counter = 0
+        self.shipped_counter = 0
+
+    def filter(self, indexed_records):
+        """
+        This function yields the (index, record) pairs to ship, looking up the fingerprints
+        of the resources by chunks of DEDUP_READ_BATCH_SIZE records.
+
+            :param indexed_records: The (index, record) pairs read from the S3 object.
+        """
+        chunk = []
+        for indexed_record in indexed_records:
+            chunk.append(indexed_record)
+            if len(chunk) >= DEDUP_READ_BATCH_SIZE:
+                yield from self.filter_chunk(chunk)
+                chunk = []
+        yield from self.filter_chunk(chunk)
+
+    def filter_chunk(self, chunk):
+        """
+        This function yields the (index, record) pairs of the chunk whose content differs from
+        the last version shipped of their resource, or whose resource has not been shipped yet.
+
+            :param chunk: The (index, record) pairs read from the S3 object.
+        """
+        entries = [(index, record, self.adapter.dedup_key(record)) for index, record in chunk]
+        last_shipped = {}
+        for _, _, key in entries:
+            if key is not None and key not in last_shipped:
+                last_shipped[key] = self.pending.get(key) or cached_fingerprint(key)
+        last_shipped.update(self.fetch([key for key, fingerprint in last_shipped.items() if fingerprint is None]))
+        for index, record, key in entries:
+            if key is not None:
+                fingerprint = self.adapter.fingerprint(record)
+                if last_shipped[key] == fingerprint:
+                    self.skipped_counter += 1
+                    continue
+                last_shipped[key] = self.pending[key] = fingerprint
+            self.shipped_counter += 1
+            yield index, record
+
+    def fetch(self, keys):
+        """
+        This function reads the fingerprints of the resources from the DynamoDB table.
+        The keys still unprocessed after the last attempt are returned as not shipped.
+
+            :param keys: The keys of the resources.
+        """
+        fingerprints = {}
+        if not keys:
+            return fingerprints
+        now = int(time.time())
+        request = {DYNAMODB_TABLE_NAME: {
+            'Keys': [{'LogGroupName': {'S': key[0]}, 'LogStreamName': {'S': key[1]}} for key in keys],
+            'ProjectionExpression': 'LogGroupName, LogStreamName, Fingerprint, #ttl',
+            'ExpressionAttributeNames': {'#ttl': 'TTL'},
+        }}
+        attempt = 0
+        while request:
+            response = get_client('dynamodb').batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(DYNAMODB_TABLE_NAME, []):
+                # expired items may not be deleted yet
+                expiry = int(item.get('TTL', {}).get('N', 0))
+                if expiry > now and 'Fingerprint' in item:
+                    key = (item['LogGroupName']['S'], item['LogStreamName']['S'])
+                    fingerprints[key] = item['Fingerprint']['S']
+                    remember_fingerprint(key, fingerprints[key], expiry)
+            request = response.get('UnprocessedKeys')
+            if request:
+                attempt += 1
+                if attempt >= get_max_try():
+                    LOGGER.warning('Fingerprints of %d resources not read, shipping them',
+                                   len(request[DYNAMODB_TABLE_NAME]['Keys']))
+                    break
+                time.sleep(backoff_delay('UnprocessedKeys', attempt))
+        return fingerprints
+
+    def commit(self):
+        """
+        This function writes the fingerprints of the records shipped. A failure is only
+        logged: the log stream has been shipped and the records are shipped again next time.
+        """
+        items = list(self.pending.items())
+        self.pending.clear()
+        expiry = int(time.time()) + self.ttl
+        try:
+            for start in range(0, len(items), DEDUP_WRITE_BATCH_SIZE):
+                request = {DYNAMODB_TABLE_NAME: [{'PutRequest': {'Item': {
+                    'LogGroupName': {'S': key[0]},
+                    'LogStreamName': {'S': key[1]},
+                    'Fingerprint': {'S': fingerprint},
+                    'TTL': {'N': str(expiry)},
+                }}} for key, fingerprint in items[start:start + DEDUP_WRITE_BATCH_SIZE]]}
+                attempt = 0
+                while request:
+                    response = get_client('dynamodb').batch_write_item(RequestItems=request)
+                    request = response.get('UnprocessedItems')
+                    if request:
+                        attempt += 1
+                        if attempt >= get_max_try():
+                            LOGGER.warning('Fingerprints of %d resources not written', len(request[DYNAMODB_TABLE_NAME]))
+                            break
+                        time.sleep(backoff_delay('UnprocessedKeys', attempt))
+        except Exception:
+            LOGGER.exception('Unable to write the fingerprints of ' + str(len(items)) + ' resources')
+        for key, fingerprint in items:
+            remember_fingerprint(key, fingerprint, expiry)
+
+class BatchUploader:
+    """
+    This class uploads the batches of a log stream from a background thread, so the
+    next batch is built while the previous one is in flight. The queue of pending
+    batches is bounded to cap the memory used.
+    """
+
+    def __init__(self, log_group_name, log_stream, deadline=None, depth=PIPELINE_DEPTH, metrics=None, sink=None):
+        """
+            :param log_group_name: The name of the log group.
+            :param log_stream: The name of the log stream.
+            :param deadline: The time.monotonic() value after which no retry is attempted.
+            :param depth: The maximum number of batches waiting to be uploaded.
+            :param metrics: The metrics of the log stream, updated by the upload thread.
+            :param sink: The output the batches are uploaded to, CloudWatch Logs by default.
+        """
+        self.log_group_name = log_group_name
+        self.log_stream = log_stream
+        self.deadline = deadline
+        self.metrics = metrics if metrics is not None else ShippingMetrics(None, None)
+        self.sink = sink if sink is not None else CloudWatchLogsSink()
+        self.batch_counter = 0
+        # checkpoints of the objects read whose records may still be buffered, in reading order
+        self.finished = []
+        # checkpoints claimed for the objects of the log stream, in reading order
+        self.checkpoints = []
+        self.queue = queue.Queue(maxsize=depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.queue.put(None)
+        self.thread.join()
+        if exc_type is not None or self.error is not None:
+            for checkpoint in self.checkpoints:
+                if not checkpoint.shipped:
+                    checkpoint.release()
+        if exc_type is None and self.error is not None:
+            raise self.error
+
+    def _run(self):
+        with self.metrics:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                # after a failure the pending batches are dropped, the producer gets the error
+                if self.error is None:
+                    log_events, progress, completed = item
+                    try:
+                        if log_events:
+                            start = time.perf_counter()
+                            self.sink.put(self.log_group_name, self.log_stream, log_events, self.deadline)
+                            self.metrics.add_time('PutTime', start)
+                        for checkpoint in completed:
+                            checkpoint.complete()
+                        if progress is not None:
+                            progress[0].save(progress[1])
+                    except Exception as exception:
+                        self.error = exception
+
+    def submit(self, log_events, progress=None, completed=()):
+        """
+        This function queues a batch of log events, waiting while the queue is full.
+        The checkpoints are updated once the batch, and the ones queued before it, have been uploaded.
+
+            :param log_events: The list of log events to be added (may be empty).
+            :param progress: The (checkpoint, record index) reached once the batch is uploaded.
+            :param completed: The checkpoints of the objects shipped once the batch is uploaded.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put((log_events, progress, completed))
+        if log_events:
+            self.batch_counter += 1
+
+    def advance(self, oldest_mark):
+        """
+        This function queues the update of the checkpoints reached once the batches queued
+        so far are uploaded: the object of the oldest record still buffered resumes from it,
+        the objects read before that one are shipped.
+
+            :param oldest_mark: The (checkpoint, record index) of the oldest record still buffered,
+                                None when every record read has been queued.
+        """
+        if oldest_mark is None:
+            completed, self.finished = self.finished, []
+        else:
+            position = self.checkpoints.index(oldest_mark[0])
+            completed = [checkpoint for checkpoint in self.finished if self.checkpoints.index(checkpoint) < position]
+            self.finished = [checkpoint for checkpoint in self.finished if checkpoint not in completed]
+        if completed or oldest_mark is not None:
+            self.submit([], oldest_mark, completed)
+
+    def claim_expiry(self):
+        """
+        This function returns the epoch time in seconds after which the claims of this
+        invocation can be taken over: when the Lambda timeout has certainly been reached.
+        """
+        if self.deadline is None:
+            return time.time() + LAMBDA_TIMEOUT_SECONDS
+        return time.time() + self.deadline - time.monotonic() + DEADLINE_MARGIN_SECONDS
+
+    def complete(self, checkpoint):
+        """
+        This function records that all the records of an object have been read: it is marked
+        as shipped by the next advance() once none of its records is buffered any more.
+
+            :param checkpoint: The checkpoint of the S3 object.
+        """
+        self.finished.append(checkpoint)
+
+class FilterRule:
+    """
+    This class is a filter rule compiled from its JSON definition:
+
+        {"name": "read-only-calls", "action": "drop", "sources": ["CloudTrail"],
+         "match": {"readOnly": [true], "eventName": ["Describe*", "List*", "Get*"]}}
+        {"name": "response-elements", "action": "truncate", "fields": ["responseElements"], "max_length": 1024}
+
+    A rule applies to the records of its sources (all by default) whose fields all
+    have one of the listed values, * and ? being wildcards in the string values, and
+    whose dotted field names reach nested fields. drop removes the matching records,
+    remove deletes the listed fields and truncate replaces the listed fields longer than
+    max_length once serialized by the first max_length characters of their JSON.
+    """
+
+    def __init__(self, definition):
+        """
+            :param definition: The definition of the rule, decoded from JSON.
+        """
+        self.name = definition['name']
+        self.action = definition['action']
+        if self.action not in FILTER_ACTIONS:
+            raise ValueError("Unsupported filter rule action: " + str(self.action))
+        self.sources = frozenset(definition['sources']) if 'sources' in definition else None
+        self.fields = [tuple(field.split('.')) for field in definition.get('fields', [])]
+        if self.action != 'drop' and not self.fields:
+            raise ValueError("Filter rule " + self.name + " has no fields")
+        self.max_length = int(definition.get('max_length', 1024))
+        if self.action == 'truncate' and self.max_length < 16:
+            raise ValueError("Filter rule " + self.name + " max_length is below 16")
+        # for each field: the accepted literal values, and a regexp of the wildcard patterns
+        self.conditions = []
+        for field, values in definition.get('match', {}).items():
+            literals = frozenset(value for value in values if not is_wildcard(value))
+            patterns = [fnmatch.translate(value) for value in values if is_wildcard(value)]
+            self.conditions.append((tuple(field.split('.')), literals, re.compile('|'.join(patterns)) if patterns else None))
+
+    def matches(self, record):
+        """
+        This function tells if the record has the values of the rule.
+
+            :param record: The record read from the S3 object.
+        """
+        for path, literals, pattern in self.conditions:
+            value = get_field(record, path)
+            if isinstance(value, (dict, list)):
+                return False
+            if value in literals:
+                continue
+            if pattern is None or not isinstance(value, str) or pattern.match(value) is None:
+                return False
+        return True
+
+    def apply(self, record, metrics):
+        """
+        This function applies the rule to a matching record. It returns the record, or None when it is dropped.
+
+            :param record: The record read from the S3 object.
+            :param metrics: The metrics the events and bytes removed are added to.
+        """
+        if self.action == 'drop':
+            metrics.add_rule(self.name, 1, len(json.dumps(record)))
+            return None
+        removed = 0
+        for path in self.fields:
+            parent = get_field(record, path[:-1]) if len(path) > 1 else record
+            if not isinstance(parent, dict) or path[-1] not in parent:
+                continue
+            value = json.dumps(parent[path[-1]])
+            if self.action == 'remove':
+                del parent[path[-1]]
+                removed += len(json.dumps(path[-1])) + 2 + len(value)
+            elif len(value) > self.max_length:
+                # the quotes of the JSON prefix are escaped in turn once it is a string
+                truncated = value[:self.max_length]
+                while len(json.dumps(truncated)) > self.max_length:
+                    truncated = truncated[:len(truncated) * self.max_length // len(json.dumps(truncated)) - 1]
+                parent[path[-1]] = truncated
+                removed += len(value) - len(json.dumps(truncated))
+        if removed:
+            metrics.add_rule(self.name, 0, removed)
+        return record
+
+class FilterRules:
+    """
+    This class is the filtering engine: the filter rules applied in order to the records
+    before they are shipped, loaded once per container (see get_filter_rules):
+
+        {"compact": true, "rules": [<filter rule>, ...]}
+
+    compact ships the records as JSON without whitespace.
+    """
+
+    def __init__(self, definition=None):
+        """
+            :param definition: The definition of the rules, decoded from JSON, None for no rule.
+        """
+        definition = definition or {}
+        self.compact = bool(definition.get('compact', False))
+        self.rules = [FilterRule(rule) for rule in definition.get('rules', [])]
+        self.active = bool(self.rules)
+        self.rules_by_source = {}
+
+    def source_rules(self, source):
+        rules = self.rules_by_source.get(source)
+        if rules is None:
+            rules = [rule for rule in self.rules if rule.sources is None or source in rule.sources]
+            self.rules_by_source[source] = rules
+        return rules
+
+    def apply(self, source, record, metrics):
+        """
+        This function applies the rules to the record. It returns the record to ship, or None when it is dropped.
+
+            :param source: The name of the source adapter of the record.
+            :param record: The record read from the S3 object.
+            :param metrics: The metrics the events and bytes removed are added to.
+        """
+        for rule in self.source_rules(source):
+            if rule.matches(record):
+                record = rule.apply(record, metrics)
+                if record is None:
+                    return None
+        return record
+
+def is_wildcard(value):
+    return isinstance(value, str) and ('*' in value or '?' in value)
+
+def get_field(record, path):
+    """
+    This function returns the value of a field of the record, None when it is missing.
+
+        :param record: The record read from the S3 object.
+        :param path: The names of the nested fields leading to the value.
+    """
+    value = record
+    for name in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+    return value
+
+class DetectionPattern:
+    """
+    This class is a CIS pattern of the metric filters of CFN/EC-lz-notifications.yml,
+    evaluated by the shipper on the CloudTrail records and named after its alarm.
+    """
+
+    def __init__(self, name, description, event_names=(), event_source=None, condition=None, threshold=1, enabled=True):
+        """
+            :param name: The name of the CloudWatch alarm of the pattern.
+            :param description: The description of the alarm.
+            :param event_names: The eventName values of the pattern, none to check every record.
+            :param event_source: The eventSource value of the pattern, None for any.
+            :param condition: A function telling if a record with one of the event names matches, None for all.
+            :param threshold: The number of matching events of an account and invocation raising an alert.
+            :param enabled: Whether the pattern is evaluated by default, as its alarm is deployed by default.
+        """
+        self.name = name
+        self.description = description
+        self.event_names = frozenset(event_names)
+        self.event_source = event_source
+        self.condition = condition
+        self.threshold = threshold
+        self.enabled = enabled
+
+    def matches(self, record):
+        """
+        This function tells if a record dispatched to the pattern matches it.
+
+            :param record: The CloudTrail record.
+        """
+        if self.event_source is not None and record.get('eventSource') != self.event_source:
+            return False
+        return self.condition is None or self.condition(record)
+
+class DetectionEngine:
+    """
+    This class evaluates the CIS patterns on the CloudTrail records. The patterns are
+    dispatched by event name once, so a record is only checked against the patterns of
+    its event name and the few patterns checking every record.
+    """
+
+    def __init__(self, patterns):
+        """
+            :param patterns: The CIS patterns to evaluate.
+        """
+        self.patterns = patterns
+        self.by_event_name = {}
+        self.any_event = []
+        for pattern in patterns:
+            if not pattern.event_names:
+                self.any_event.append(pattern)
+            for event_name in pattern.event_names:
+                self.by_event_name.setdefault(event_name, []).append(pattern)
+
+    def detect(self, record):
+        """
+        This function returns the CIS patterns the record matches.
+
+            :param record: The CloudTrail record.
+        """
+        matches = [pattern for pattern in self.any_event if pattern.matches(record)]
+        for pattern in self.by_event_name.get(record.get('eventName'), ()):
+            if pattern.matches(record):
+                matches.append(pattern)
+        return matches
+
+def is_root_activity(record):
+    identity = record.get('userIdentity') or {}
+    return identity.get('type') == 'Root' and 'invokedBy' not in identity and record.get('eventType') != 'AwsServiceEvent'
+
+def is_authorization_failure(record):
+    error_code = record.get('errorCode') or ''
+    return error_code.endswith('UnauthorizedOperation') or error_code.startswith('AccessDenied')
+
+LARGE_INSTANCE_TYPE = re.compile(r'.*\.(32|24|18|16|12|10|9|8|4)xlarge$')
+EC2_INSTANCE_EVENTS = ('RunInstances', 'RebootInstances', 'StartInstances', 'StopInstances', 'TerminateInstances')
+
+# the patterns of the metric filters of CFN/EC-lz-notifications.yml, keep them in sync
+DETECTION_PATTERNS = [
+    DetectionPattern('VPCSecurityGroupChanges', 'An API call is made to create, update or delete a Security Group.',
+                     ('AuthorizeSecurityGroupIngress', 'AuthorizeSecurityGroupEgress', 'RevokeSecurityGroupIngress',
+                      'RevokeSecurityGroupEgress', 'CreateSecurityGroup', 'DeleteSecurityGroup')),
+    DetectionPattern('CloudTrailNetworkAclChanges', 'An API call is made to create, update or delete a Network ACL.',
+                     ('CreateNetworkAcl', 'CreateNetworkAclEntry', 'DeleteNetworkAcl', 'DeleteNetworkAclEntry',
+                      'ReplaceNetworkAclEntry', 'ReplaceNetworkAclAssociation')),
+    DetectionPattern('CloudTrailGatewayChanges', 'An API call is made to create, update or delete a Customer or Internet Gateway.',
+                     ('CreateCustomerGateway', 'DeleteCustomerGateway', 'AttachInternetGateway', 'CreateInternetGateway',
+                      'DeleteInternetGateway', 'DetachInternetGateway')),
+    DetectionPattern('CloudTrailVpcChanges', 'An API call is made to create, update or delete a VPC, VPC peering connection or VPC connection to classic.',
+                     ('CreateVpc', 'DeleteVpc', 'ModifyVpcAttribute', 'AcceptVpcPeeringConnection', 'CreateVpcPeeringConnection',
+                      'DeleteVpcPeeringConnection', 'RejectVpcPeeringConnection', 'AttachClassicLinkVpc', 'DetachClassicLinkVpc',
+                      'DisableVpcClassicLink', 'EnableVpcClassicLink')),
+    DetectionPattern('CloudTrailEC2InstanceChanges', 'An API call is made to create, terminate, start, stop or reboot an EC2 instance.',
+                     EC2_INSTANCE_EVENTS, enabled=False),
+    DetectionPattern('CloudTrailS3BucketPolicyChanges', 'An API call is made to PUT or DELETE bucket policy, bucket lifecycle, bucket replication or to PUT a bucket ACL.',
+                     ('PutBucketAcl', 'PutBucketPolicy', 'PutBucketCors', 'PutBucketLifecycle', 'PutBucketReplication',
+                      'DeleteBucketPolicy', 'DeleteBucketCors', 'DeleteBucketLifecycle', 'DeleteBucketReplication'),
+                     event_source='s3.amazonaws.com'),
+    DetectionPattern('CloudTrailEC2LargeInstanceChanges', 'An API call is made to create, terminate, start, stop or reboot a 4x-large or greater EC2 instance.',
+                     EC2_INSTANCE_EVENTS, enabled=False,
+                     condition=lambda record: LARGE_INSTANCE_TYPE.match(str(get_field(record, ('requestParameters', 'instanceType')))) is not None),
+    DetectionPattern('ConfigChanges', 'An API call is made to create, update or delete a config rule change.',
+                     ('StopConfigurationRecorder', 'DeleteDeliveryChannel', 'PutDeliveryChannel', 'PutConfigurationRecorder'),
+                     event_source='config.amazonaws.com'),
+    DetectionPattern('CloudTrailChanges', 'An API call is made to create, update or delete a CloudTrail trail, or to start or stop logging to a trail.',
+                     ('CreateTrail', 'UpdateTrail', 'DeleteTrail', 'StartLogging', 'StopLogging')),
+    DetectionPattern('CloudTrailConsoleSignInFailures', 'An unauthenticated API call is made to sign into the console.',
+                     ('ConsoleLogin',), condition=lambda record: record.get('errorMessage') == 'Failed authentication', threshold=3),
+    DetectionPattern('CloudTrailAuthorizationFailures', 'An unauthorized API call is made.', condition=is_authorization_failure),
+    DetectionPattern('IAMPolicyChanges', 'IAM policy changes are made.',
+                     ('DeleteGroupPolicy', 'DeleteRolePolicy', 'DeleteUserPolicy', 'PutGroupPolicy', 'PutRolePolicy', 'PutUserPolicy',
+                      'CreatePolicy', 'DeletePolicy', 'CreatePolicyVersion', 'DeletePolicyVersion', 'AttachRolePolicy', 'DetachRolePolicy',
+                      'AttachUserPolicy', 'DetachUserPolicy', 'AttachGroupPolicy', 'DetachGroupPolicy')),
+    DetectionPattern('RootLogin', 'The root user is used.', condition=is_root_activity),
+    DetectionPattern('ConsoleMFALogin', 'A user logs in to the console without MFA.',
+                     ('ConsoleLogin',), condition=lambda record: get_field(record, ('additionalEventData', 'MFAUsed')) != 'Yes'),
+    DetectionPattern('RouteTableChange', 'A route table is changed.',
+                     ('CreateRoute', 'CreateRouteTable', 'ReplaceRoute', 'ReplaceRouteTableAssociation', 'DeleteRouteTable',
+                      'DeleteRoute', 'DisassociateRouteTable')),
+    DetectionPattern('CMKdeletion', 'A CMK is disabled or scheduled for deletion.',
+                     ('DisableKey', 'ScheduleKeyDeletion'), event_source='kms.amazonaws.com'),
+]
+
+def alert_sample(record):
+    """
+    This function returns the fields of a CloudTrail record described in an alert.
+
+        :param record: The CloudTrail record.
+    """
+    identity = record.get('userIdentity') or {}
+    return OrderedDict([
+        ('eventTime', record.get('eventTime')),
+        ('eventSource', record.get('eventSource')),
+        ('eventName', record.get('eventName')),
+        ('awsRegion', record.get('awsRegion')),
+        ('recipientAccountId', record.get('recipientAccountId')),
+        ('userIdentity', identity.get('arn') or identity.get('type')),
+        ('sourceIPAddress', record.get('sourceIPAddress')),
+        ('errorCode', record.get('errorCode')),
+        ('eventID', record.get('eventID')),
+    ])
+
+def publish_alerts(metrics):
+    """
+    This function publishes to the SecLog SNS topic one alert per linked account and CIS
+    pattern matched by at least its threshold of records during the invocation, unless
+    the pattern was already matched in that account during the suppression window (see
+    alert_suppressed). A failed publication is logged, it does not fail the shipping.
+
+        :param metrics: The metrics of the log streams shipped by the invocation.
+    """
+    detections = OrderedDict()
+    for stream_metrics in metrics:
+        account_detections = detections.setdefault(stream_metrics.account, ShippingMetrics(stream_metrics.source, stream_metrics.account))
+        account_detections.merge(stream_metrics)
+    for account, account_detections in detections.items():
+        for name, (pattern, events, samples) in account_detections.detections.items():
+            if events < pattern.threshold:
+                continue
+            message = OrderedDict([
+                ('alarm', name),
+                ('description', pattern.description),
+                ('account', account),
+                ('events', events),
+                ('samples', samples),
+            ])
+            LOGGER.warning('CIS pattern %s matched by %d events of account %s', name, events, account)
+            if alert_suppressed(account, name):
+                LOGGER.info('CIS alert ' + name + ' of account ' + str(account) + ' suppressed, already raised')
+                continue
+            try:
+                get_client('sns').publish(TopicArn=get_alert_topic_arn(),
+                                          Subject=('CIS alarm ' + name + ' in account ' + str(account))[:100],
+                                          Message=json.dumps(message, indent=4))
+            except Exception:
+                LOGGER.exception('CIS alert ' + name + ' not published')
+
+def alert_suppressed(account, name):
+    """
+    This function tells if the alert of the pattern has already been raised for the account:
+    as long as the pattern keeps matching less than ALERT_SUPPRESSION_SECONDS apart, only
+    the first match is published, the way an alarm only notifies when its state changes.
+    Each match extends the window with an atomic update of the DynamoDB table, so concurrent
+    invocations publish once. When the table cannot be updated, the alert is published.
+
+        :param account: The linked account.
+        :param name: The name of the CIS pattern.
+    """
+    now = int(time.time())
+    expiry = now + get_alert_suppression_seconds()
+    try:
+        response = get_client('dynamodb').update_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={'LogGroupName': {'S': ALERT_KEY_PREFIX + str(account)}, 'LogStreamName': {'S': name}},
+            UpdateExpression='SET Expiry = :expiry, #ttl = :ttl',
+            ExpressionAttributeNames={'#ttl': 'TTL'},
+            ExpressionAttributeValues={':expiry': {'N': str(expiry)}, ':ttl': {'N': str(expiry + SEVEN_DAYS_IN_SECONDS)}},
+            ReturnValues='UPDATED_OLD'
+        )
+    except Exception:
+        LOGGER.exception('Unable to check the suppression of the CIS alert ' + name)
+        return False
+    previous_expiry = response.get('Attributes', {}).get('Expiry', {}).get('N')
+    return previous_expiry is not None and int(previous_expiry) >= now
+
+class CloudWatchLogsSink:
+    """
+    This class is the default output of the shipper: the log stream of each linked
+    account, source and region in CloudWatch Logs.
+    """
+    name = 'cloudwatch'
+
+    def prepare(self, log_group_name, log_stream):
+        """
+        This function makes sure the log stream exists before its batches are uploaded.
+
+            :param log_group_name: The name of the log group.
+            :param log_stream: The name of the log stream.
+        """
+        create_log_stream(log_group_name, log_stream)
+
+    def batch_builder(self):
+        """
+        This function returns a batch builder for the PutLogEvents limits.
+        """
+        return BatchBuilder()
+
+    def put(self, log_group_name, log_stream, log_events, deadline=None):
+        """
+        This function uploads a batch of log events to the log stream.
+
+            :param log_group_name: The name of the log group.
+            :param log_stream: The name of the log stream.
+            :param log_events: The list of log events to be added.
+            :param deadline: The time.monotonic() value after which no retry is attempted.
+        """
+        ship_log_events(log_group_name, log_stream, log_events, deadline)
+
+class FirehoseSink:
+    """
+    This class sends the records to a Kinesis Data Firehose delivery stream with
+    PutRecordBatch, one newline-delimited JSON record per log event, for the
+    destinations taking bulk volume. Log groups and log streams only group the
+    records by upload thread, the records are sent unchanged whatever their age.
+    """
+    name = 'firehose'
+
+    def __init__(self, delivery_stream_name):
+        """
+            :param delivery_stream_name: The name of the Firehose delivery stream.
+        """
+        self.delivery_stream_name = delivery_stream_name
+
+    def prepare(self, log_group_name, log_stream):
+        pass
+
+    def batch_builder(self):
+        """
+        This function returns a batch builder for the PutRecordBatch limits.
+        """
+        return BatchBuilder(MAX_FIREHOSE_RECORDS_PER_BATCH, MAX_FIREHOSE_BATCH_SIZE, FIREHOSE_RECORD_OVERHEAD,
+                            MAX_FIREHOSE_RECORD_SIZE, time_bounded=False)
+
+    def put(self, log_group_name, log_stream, log_events, deadline=None):
+        """
+        This function sends a batch of log events to the delivery stream.
+
+            :param log_group_name: The name of the log group (unused).
+            :param log_stream: The name of the log stream (unused).
+            :param log_events: The list of log events to be sent.
+            :param deadline: The time.monotonic() value after which no retry is attempted.
+        """
+        put_record_batch(self.delivery_stream_name, log_events, deadline)
+
+class ParquetArchive:
+    """
+    This class writes a columnar copy of the records of a log stream for Athena, as Parquet
+    files partitioned like Hive tables: <prefix><source>/account=<id>/region=<region>/date=<yyyy-mm-dd>/.
+    The fields listed by the source adapter are string columns, nested values as JSON text,
+    the other fields of a record are gathered in the otherFields column. The files are written
+    locally by row groups of row_group_rows records and uploaded at the end of the log stream,
+    then merged by the scheduled compaction (see compact_archive). The archive never fails the
+    shipping: after an error, it is disabled for the rest of the log stream.
+    """
+
+    def __init__(self, adapter, log_stream, bucketname=None, prefix=ARCHIVE_PREFIX, row_group_rows=ARCHIVE_ROW_GROUP_ROWS):
+        """
+            :param adapter: The source adapter of the records.
+            :param log_stream: The name of the log stream, naming the files with a unique suffix.
+            :param bucketname: The S3 bucket of the archive, None for the bucket of the log files.
+            :param prefix: The S3 key prefix of the archive.
+            :param row_group_rows: The number of records of a row group.
+        """
+        self.adapter = adapter
+        self.name = log_stream.replace(SHARD_SEPARATOR, '-') + '-' + uuid.uuid4().hex
+        self.bucketname = bucketname
+        self.prefix = prefix
+        self.row_group_rows = row_group_rows
+        self.known_fields = frozenset(adapter.archive_columns)
+        self.schema = pyarrow.schema([pyarrow.field('timestamp', pyarrow.timestamp('ms', tz='UTC'))]
+                                     + [pyarrow.field(column, pyarrow.string())
+                                        for column in adapter.archive_columns + (ARCHIVE_OTHER_FIELDS,)])
+        # (bucket, account, region, day): file of the partition
+        self.files = OrderedDict()
+        self.failed = False
+
+    def collect(self, indexed_records, checkpoint, bucketname, filename, event_timestamp):
+        """
+        This function yields the (index, record) pairs unchanged, adding each record to the archive.
+
+            :param indexed_records: The (index, record) pairs read from the S3 object.
+            :param checkpoint: The checkpoint of the S3 object.
+            :param bucketname: The name of the S3 bucket.
+            :param filename: The key of the S3 object (AWSLogs/<account>/<source>/<region>/...).
+            :param event_timestamp: The time of the S3 event in milliseconds.
+        """
+        l = filename.split('/')
+        for record_index, record in indexed_records:
+            if not self.failed:
+                try:
+                    self.add(bucketname, l[1], l[3], self.adapter.timestamp(record, event_timestamp), record,
+                             checkpoint, record_index)
+                except Exception:
+                    LOGGER.exception('Archive of log stream ' + self.name + ' disabled')
+                    self.discard()
+            yield record_index, record
+
+    def add(self, bucketname, account, region, timestamp, record, checkpoint=None, record_index=None):
+        """
+        This function adds the record to the file of its partition, writing a row group when it is full.
+
+            :param bucketname: The name of the S3 bucket of the log file.
+            :param account: The linked account the log file comes from.
+            :param region: The region of the log file.
+            :param timestamp: The timestamp of the record in milliseconds.
+            :param record: The record read from the S3 object.
+            :param checkpoint: The checkpoint of the S3 object, None when the record is not tracked.
+            :param record_index: The index of the record in the S3 object.
+        """
+        key = (bucketname, account, region, timestamp // 86400000)
+        archive_file = self.files.get(key)
+        if archive_file is None:
+            date = time.strftime('%Y-%m-%d', time.gmtime(timestamp / 1000))
+            archive_file = self.files[key] = ArchiveFile(self.schema, self.bucketname or bucketname,
+                                                         self.prefix + self.adapter.name + '/account=' + account + '/region='
+                                                         + region + '/date=' + date + '/' + self.name + '.parquet')
+        other_fields = {field: value for field, value in record.items() if field not in self.known_fields}
+        archive_file.append([timestamp] + [archive_value(record.get(column)) for column in self.adapter.archive_columns]
+                            + [ARCHIVE_ENCODER.encode(other_fields) if other_fields else None], checkpoint, record_index)
+        if archive_file.rows >= self.row_group_rows:
+            start = time.perf_counter()
+            archive_file.write_row_group()
+            current_metrics().add_time('ArchiveTime', start)
+
+    def close(self):
+        """
+        This function completes the files of the archive and uploads them. When the log stream
+        has failed, only the records saved by the checkpoints of their objects are kept: the
+        redelivery archives the others. A failure is only logged: the archive is a copy of the
+        log files and does not hold the shipping back.
+        """
+        if self.failed:
+            return
+        metrics = current_metrics()
+        for archive_file in self.files.values():
+            start = time.perf_counter()
+            try:
+                archive_file.close()
+                mask = archive_file.saved_mask()
+                if mask is not None:
+                    archive_file.cut(mask)
+                    LOGGER.info(str(mask.count(False)) + ' records of ' + archive_file.key + ' left to the redelivery')
+                if archive_file.row_counter:
+                    with open(archive_file.path, 'rb') as body:
+                        get_client('s3').put_object(Bucket=archive_file.bucketname, Key=archive_file.key, Body=body)
+                    metrics.add('ArchivedRecords', archive_file.row_counter)
+                    metrics.add('ArchivedBytes', os.path.getsize(archive_file.path))
+            except Exception:
+                LOGGER.exception('Unable to archive ' + str(archive_file.row_counter + archive_file.rows)
+                                 + ' records to ' + archive_file.key)
+                metrics.add('ArchiveFailures')
+            try:
+                archive_file.remove()
+            except Exception:
+                LOGGER.exception('Unable to remove the local file of ' + archive_file.key)
+            metrics.add_time('ArchiveTime', start)
+        self.files.clear()
+
+    def discard(self):
+        """
+        This function gives up the archive of the log stream after an error (pyarrow, /tmp full):
+        its files are removed and the records read afterwards are not archived.
+        """
+        self.failed = True
+        current_metrics().add('ArchiveFailures')
+        for archive_file in self.files.values():
+            try:
+                archive_file.remove()
+            except Exception:
+                LOGGER.exception('Unable to remove the local file of ' + archive_file.key)
+        self.files.clear()
+
+class ArchiveFile:
+    """
+    This class is the Parquet file of a partition of the archive, written in a local
+    temporary file one row group at a time.
+    """
+
+    def __init__(self, schema, bucketname, key):
+        """
+            :param schema: The schema of the archive.
+            :param bucketname: The S3 bucket the file is uploaded to.
+            :param key: The S3 key the file is uploaded to.
+        """
+        self.schema = schema
+        self.bucketname = bucketname
+        self.key = key
+        self.columns = [[] for _ in schema]
+        # Arrow arrays of the buffered rows already converted, by column
+        self.chunks = [[] for _ in schema]
+        self.rows = 0
+        self.row_counter = 0
+        self.path = None
+        self.writer = None
+        # (checkpoint, first row) of the rows of each S3 object and the index of each row in its object
+        self.checkpoints = []
+        self.record_indexes = array.array('L')
+
+    def append(self, row, checkpoint=None, record_index=None):
+        """
+        This function buffers a row of the next row group.
+
+            :param row: The values of the row, in the order of the schema.
+            :param checkpoint: The checkpoint of the S3 object of the row, None when the row is not tracked.
+            :param record_index: The index of the record in the S3 object.
+        """
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        if checkpoint is not None:
+            if not self.checkpoints or self.checkpoints[-1][0] is not checkpoint:
+                self.checkpoints.append((checkpoint, len(self.record_indexes)))
+            self.record_indexes.append(record_index)
+        self.rows += 1
+        if len(self.columns[0]) >= ARCHIVE_CHUNK_ROWS:
+            self.convert()
+
+    def convert(self):
+        """
+        This function converts the rows buffered as Python values to Arrow arrays.
+        """
+        for chunks, column, field in zip(self.chunks, self.columns, self.schema):
+            chunks.append(pyarrow.array(column, type=field.type))
+        self.columns = [[] for _ in self.schema]
+
+    def write_row_group(self):
+        """
+        This function writes the buffered rows as a row group of the file.
+        """
+        if not self.rows:
+            return
+        if self.columns[0]:
+            self.convert()
+        if self.writer is None:
+            fd, self.path = tempfile.mkstemp(suffix='.parquet', dir=ARCHIVE_DIRECTORY)
+            os.close(fd)
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=ARCHIVE_COMPRESSION)
+        arrays = [pyarrow.chunked_array(chunks, type=field.type) for chunks, field in zip(self.chunks, self.schema)]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema), row_group_size=self.rows)
+        self.row_counter += self.rows
+        self.chunks = [[] for _ in self.schema]
+        self.rows = 0
+
+    def close(self):
+        """
+        This function writes the last row group and completes the file.
+        """
+        self.write_row_group()
+        self.writer.close()
+
+    def saved_mask(self):
+        """
+        This function returns whether each row of the file is saved by the checkpoint of its
+        S3 object (see ObjectCheckpoint.is_saved), None when all of them are.
+        """
+        if all(checkpoint.shipped for checkpoint, _ in self.checkpoints):
+            return None
+        mask = []
+        ends = [first_row for _, first_row in self.checkpoints[1:]] + [len(self.record_indexes)]
+        for (checkpoint, first_row), end in zip(self.checkpoints, ends):
+            mask.extend(checkpoint.is_saved(record_index) for record_index in self.record_indexes[first_row:end])
+        return None if all(mask) else mask
+
+    def cut(self, mask):
+        """
+        This function rewrites the completed file with the rows of the mask, one row group at a time.
+
+            :param mask: Whether each row of the file is kept.
+        """
+        fd, path = tempfile.mkstemp(suffix='.parquet', dir=ARCHIVE_DIRECTORY)
+        os.close(fd)
+        writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=ARCHIVE_COMPRESSION)
+        offset = 0
+        try:
+            with pyarrow.parquet.ParquetFile(self.path) as source:
+                for index in range(source.num_row_groups):
+                    row_group = source.read_row_group(index)
+                    end = offset + row_group.num_rows
+                    row_group = row_group.filter(pyarrow.array(mask[offset:end]))
+                    offset = end
+                    if row_group.num_rows:
+                        writer.write_table(row_group, row_group_size=row_group.num_rows)
+        finally:
+            writer.close()
+            os.remove(self.path)
+            self.path = path
+        self.row_counter = mask.count(True)
+
+    def remove(self):
+        """
+        This function removes the local file.
+        """
+        if self.writer is not None:
+            self.writer.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+def compact_archive(event, context):
+    """
+    This function is the handler of the scheduled compaction of the Parquet archive. Each
+    invocation of the shipper writes its own small files, a few hundred rows each in the S3
+    ingestion mode: the files of every partition of the last ARCHIVE_COMPACT_DAYS days are
+    merged into files with full row groups, then deleted. Files written during the compaction
+    are left for the next run. The partitions not reached before the deadline are compacted
+    by the next run too.
+
+        :param event: The event of the schedule (unused).
+        :param context: The Lambda context of the invocation.
+    """
+    LOGGER.setLevel(check_log_level())
+    if pyarrow is None:
+        raise ImportError('pyarrow is required by the compaction of the archive')
+    deadline = get_deadline(context)
+    today = int(time.time()) // 86400
+    dates = [time.strftime('%Y-%m-%d', time.gmtime((today - days) * 86400)) for days in range(1, get_archive_compact_days() + 1)]
+    compacted = 0
+    for bucketname in get_archive_compact_buckets():
+        for source_prefix in list_prefixes(bucketname, get_archive_prefix()):
+            for account_prefix in list_prefixes(bucketname, source_prefix):
+                for region_prefix in list_prefixes(bucketname, account_prefix):
+                    for date in dates:
+                        if time.monotonic() > deadline:
+                            LOGGER.warning('Compaction interrupted by the deadline after %d partitions', compacted)
+                            return
+                        try:
+                            if compact_partition(bucketname, region_prefix + 'date=' + date + '/', get_archive_row_group_rows(), deadline):
+                                compacted += 1
+                        except Exception:
+                            LOGGER.exception('Unable to compact ' + region_prefix + 'date=' + date + '/')
+    LOGGER.info('%d partitions of the archive compacted', compacted)
+
+def list_prefixes(bucketname, prefix):
+    """
+    This function returns the prefixes one level below the prefix (e.g. the account=<id>/ partitions).
+
+        :param bucketname: The name of the S3 bucket.
+        :param prefix: The S3 key prefix, ending with a slash.
+    """
+    prefixes = []
+    for page in get_client('s3').get_paginator('list_objects_v2').paginate(Bucket=bucketname, Prefix=prefix, Delimiter='/'):
+        prefixes.extend(common_prefix['Prefix'] for common_prefix in page.get('CommonPrefixes', []))
+    return prefixes
+
+def list_keys(bucketname, prefix):
+    """
+    This function returns the keys of the objects under the prefix.
+
+        :param bucketname: The name of the S3 bucket.
+        :param prefix: The S3 key prefix.
+    """
+    keys = []
+    for page in get_client('s3').get_paginator('list_objects_v2').paginate(Bucket=bucketname, Prefix=prefix):
+        keys.extend(item['Key'] for item in page.get('Contents', []))
+    return keys
+
+def delete_keys(bucketname, keys):
+    """
+    This function deletes the objects, raising an error when one of them could not be deleted.
+    Deleting an object already deleted succeeds, the deletion can be repeated.
+
+        :param bucketname: The name of the S3 bucket.
+        :param keys: The keys of the objects.
+    """
+    for start in range(0, len(keys), MAX_DELETE_OBJECTS):
+        response = get_client('s3').delete_objects(Bucket=bucketname, Delete={
+            'Objects': [{'Key': key} for key in keys[start:start + MAX_DELETE_OBJECTS]], 'Quiet': True})
+        errors = response.get('Errors', [])
+        if errors:
+            raise Exception(str(len(errors)) + ' objects not deleted, ' + errors[0]['Key'] + ': ' + errors[0].get('Message', ''))
+
+def compact_partition(bucketname, prefix, row_group_rows, deadline):
+    """
+    This function merges the Parquet files written by the shipper in a partition into files
+    of row groups of row_group_rows records. The files of the previous compactions are kept
+    as they are. The merge is all or nothing: after a failure or when the deadline is reached,
+    the merged files already uploaded are deleted and the partition is left as it was. Once
+    all the merged files are uploaded, a manifest lists the files merged until they are all
+    deleted: a deletion interrupted is completed by the next run, which never merges them
+    again. It returns True when the partition has been compacted, False otherwise.
+
+        :param bucketname: The name of the S3 bucket.
+        :param prefix: The S3 key prefix of the partition, ending with a slash.
+        :param row_group_rows: The number of records of a row group.
+        :param deadline: The time.monotonic() value after which no file is merged.
+    """
+    s3 = get_client('s3')
+    keys = list_keys(bucketname, prefix)
+    manifests = [key for key in keys if key[len(prefix):].startswith(ARCHIVE_MANIFEST_PREFIX)]
+    for manifest in manifests:
+        merged_keys = json.loads(s3.get_object(Bucket=bucketname, Key=manifest)['Body'].read())
+        delete_keys(bucketname, merged_keys)
+        delete_keys(bucketname, [manifest])
+        LOGGER.info('Deletion of the %d files merged in %s completed', len(merged_keys), prefix)
+    if manifests:
+        keys = list_keys(bucketname, prefix)
+    keys = [key for key in keys if key.endswith('.parquet') and not key[len(prefix):].startswith(ARCHIVE_COMPACTED_PREFIX)]
+    if len(keys) <= 1:
+        return False
+    merged = ArchiveMerger(bucketname, prefix, row_group_rows)
+    try:
+        for key in keys:
+            if time.monotonic() > deadline:
+                LOGGER.warning('Compaction of ' + prefix + ' given up, the deadline is reached')
+                delete_keys(bucketname, merged.keys)
+                return False
+            body = s3.get_object(Bucket=bucketname, Key=key)['Body']
+            merged.add(pyarrow.parquet.read_table(pyarrow.BufferReader(body.read())))
+        merged.close()
+        manifest = prefix + ARCHIVE_MANIFEST_PREFIX + uuid.uuid4().hex + '.json'
+        s3.put_object(Bucket=bucketname, Key=manifest, Body=json.dumps(keys).encode('utf-8'))
+    except Exception:
+        delete_keys(bucketname, merged.keys)
+        raise
+    finally:
+        merged.remove()
+    # the merged files are committed: their rows are in the new files
+    delete_keys(bucketname, keys)
+    delete_keys(bucketname, [manifest])
+    LOGGER.info('%d files of %s merged into %d files of %d records', len(keys), prefix, len(merged.keys), merged.row_counter)
+    return True
+
+class ArchiveMerger:
+    """
+    This class writes the tables of the files of a partition as full row groups, in local
+    files of at most ARCHIVE_COMPACT_FILE_ROWS records uploaded once complete.
+    """
+
+    def __init__(self, bucketname, prefix, row_group_rows):
+        """
+            :param bucketname: The S3 bucket the files are uploaded to.
+            :param prefix: The S3 key prefix of the partition.
+            :param row_group_rows: The number of records of a row group.
+        """
+        self.bucketname = bucketname
+        self.prefix = prefix
+        self.row_group_rows = row_group_rows
+        self.tables = []
+        self.rows = 0
+        self.row_counter = 0
+        self.keys = []
+        self.archive_file = None
+
+    def add(self, table):
+        """
+        This function buffers the table of a file, writing the full row groups.
+
+            :param table: The records of a file of the partition.
+        """
+        self.tables.append(table)
+        self.rows += table.num_rows
+        if self.rows >= self.row_group_rows:
+            self.write(self.rows - self.rows % self.row_group_rows)
+
+    def write(self, rows):
+        """
+        This function writes the first rows buffered, as row groups of row_group_rows records.
+
+            :param rows: The number of rows to write.
+        """
+        table = pyarrow.concat_tables(self.tables)
+        for offset in range(0, rows, self.row_group_rows):
+            if self.archive_file is None:
+                self.archive_file = ArchiveFile(table.schema, self.bucketname,
+                                                self.prefix + ARCHIVE_COMPACTED_PREFIX + uuid.uuid4().hex + '.parquet')
+            row_group = table.slice(offset, min(self.row_group_rows, rows - offset))
+            self.archive_file.chunks = [column.chunks for column in row_group.columns]
+            self.archive_file.rows = row_group.num_rows
+            self.archive_file.write_row_group()
+            if self.archive_file.row_counter >= ARCHIVE_COMPACT_FILE_ROWS:
+                self.upload()
+        self.tables = [table.slice(rows)]
+        self.rows -= rows
+
+    def upload(self):
+        """
+        This function completes the current file and uploads it.
+        """
+        self.archive_file.close()
+        # kept before the upload: a file uploaded despite an error is deleted with the others
+        self.keys.append(self.archive_file.key)
+        with open(self.archive_file.path, 'rb') as body:
+            get_client('s3').put_object(Bucket=self.bucketname, Key=self.archive_file.key, Body=body)
+        self.row_counter += self.archive_file.row_counter
+        self.archive_file.remove()
+        self.archive_file = None
+
+    def close(self):
+        """
+        This function writes the remaining rows and uploads the last file.
+        """
+        if self.rows:
+            self.write(self.rows)
+        if self.archive_file is not None:
+            self.upload()
+
+    def remove(self):
+        """
+        This function removes the local file not uploaded.
+        """
+        if self.archive_file is not None:
+            self.archive_file.remove()
+
+class ShippingMetrics:
+    """
+    This class accumulates the metrics of a log stream during an invocation, for
+    the CloudWatch embedded metric format records written at the end of it. The
+    thread reading the S3 objects and the upload thread of the log stream both
+    update them: a thread binds the metrics with a with statement and the shipping
+    functions find them with current_metrics().
+    """
+
+    def __init__(self, source, account):
+        """
+            :param source: The name of the source adapter of the log stream.
+            :param account: The linked account the log files come from.
+        """
+        self.source = source
+        self.account = account
+        self.values = Counter()
+        self.fill_ratios = []
+        # (rule name, metric name) values of the filter rules
+        self.rule_values = Counter()
+        # API calls by (account, region, event source, event name, error code) of the
+        # records shipped, added by commit_activity() at the end of the log stream
+        self.activity = Counter()
+        # (checkpoint, record indexes, key ids) of the API calls counted by S3 object and the
+        # ids of their keys, only updated by the thread reading the S3 objects
+        self.pending_activity = []
+        self.activity_ids = {}
+        # CIS pattern name: [pattern, events, sample records], updated by the same thread
+        self.detections = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        CURRENT_METRICS.metrics = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        CURRENT_METRICS.metrics = None
+
+    def add(self, name, value=1):
+        """
+        This function adds the value to the metric.
+
+            :param name: The name of the metric.
+            :param value: The value to add.
+        """
+        with self.lock:
+            self.values[name] += value
+
+    def add_time(self, name, start):
+        """
+        This function adds the milliseconds elapsed since start to the metric.
+
+            :param name: The name of the metric.
+            :param start: The time.perf_counter() value at the start of the phase.
+        """
+        self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add_rule(self, rule, events, size):
+        """
+        This function adds the events and bytes removed by a filter rule.
+
+            :param rule: The name of the filter rule.
+            :param events: The number of events dropped.
+            :param size: The number of bytes removed.
+        """
+        with self.lock:
+            self.values['FilteredEvents'] += events
+            self.values['FilteredBytes'] += size
+            self.rule_values[(rule, 'FilteredEvents')] += events
+            self.rule_values[(rule, 'FilteredBytes')] += size
+
+    def count_activity(self, record, checkpoint, record_index):
+        """
+        This function counts the API call of a CloudTrail record, until commit_activity() tells if it is shipped.
+
+            :param record: The record read from the S3 object.
+            :param checkpoint: The checkpoint of the S3 object.
+            :param record_index: The index of the record in the S3 object.
+        """
+        key = (record.get('recipientAccountId') or self.account, record.get('awsRegion'),
+               record.get('eventSource'), record.get('eventName'), record.get('errorCode'))
+        key_id = self.activity_ids.setdefault(key, len(self.activity_ids))
+        if not self.pending_activity or self.pending_activity[-1][0] is not checkpoint:
+            self.pending_activity.append((checkpoint, array.array('L'), array.array('L')))
+        self.pending_activity[-1][1].append(record_index)
+        self.pending_activity[-1][2].append(key_id)
+
+    def commit_activity(self):
+        """
+        This function adds the API calls of the records saved by their checkpoints to the counters:
+        all of them once the log stream is shipped, only those before the saved record count of
+        each S3 object after a failure, the redelivery counting the others.
+        """
+        keys = list(self.activity_ids)
+        for checkpoint, record_indexes, key_ids in self.pending_activity:
+            if checkpoint.shipped:
+                self.activity.update(keys[key_id] for key_id in key_ids)
+            else:
+                self.activity.update(keys[key_id] for key_id, record_index in zip(key_ids, record_indexes)
+                                     if checkpoint.is_saved(record_index))
+        self.pending_activity = []
+        self.activity_ids = {}
+
+    def add_detection(self, pattern, record):
+        """
+        This function records a CloudTrail record matching a CIS pattern.
+
+            :param pattern: The CIS pattern matched.
+            :param record: The record read from the S3 object.
+        """
+        detection = self.detections.setdefault(pattern.name, [pattern, 0, []])
+        detection[1] += 1
+        if len(detection[2]) < MAX_ALERT_SAMPLES:
+            detection[2].append(alert_sample(record))
+        self.add('DetectedEvents')
+
+    def maximum(self, name, value):
+        """
+        This function keeps the highest value of the metric.
+
+            :param name: The name of the metric.
+            :param value: The value to compare.
+        """
+        with self.lock:
+            self.values[name] = max(self.values.get(name, value), value)
+
+    def timed(self, iterable, name):
+        """
+        This function yields the items of the iterable, adding the time spent in producing them to the metric.
+
+            :param iterable: The iterable to time.
+            :param name: The name of the metric.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, start)
+                return
+            self.add_time(name, start)
+            yield item
+
+    def merge(self, other):
+        """
+        This function adds the metrics of another log stream to these ones.
+
+            :param other: The metrics to add.
+        """
+        for name, value in other.values.items():
+            if name == 'IngestionLag':
+                self.maximum(name, value)
+            else:
+                self.add(name, value)
+        self.fill_ratios.extend(other.fill_ratios)
+        with self.lock:
+            self.rule_values.update(other.rule_values)
+            self.activity.update(other.activity)
+            for name, (pattern, events, samples) in other.detections.items():
+                detection = self.detections.setdefault(name, [pattern, 0, []])
+                detection[1] += events
+                detection[2].extend(samples[:MAX_ALERT_SAMPLES - len(detection[2])])
+
+    def emf_documents(self):
+        """
+        This function returns the embedded metric format records of the metrics, dimensioned
+        by source and account. The batch fill ratios beyond the first MAX_EMF_VALUES values
+        are written in additional records.
+        """
+        values = dict(self.values)
+        # the body of the objects is read and decompressed while the records are parsed
+        read_time = values.pop('ReadTime', 0)
+        values['DownloadTime'] = values.get('DownloadTime', 0) + read_time
+        values['ParseTime'] = values.get('ParseTime', 0) - values.get('DecompressTime', 0) - read_time
+        fill_ratios = [round(ratio, 4) for ratio in self.fill_ratios]
+        values['BatchFillRatio'] = fill_ratios[:MAX_EMF_VALUES]
+        units = OrderedDict()
+        for name, unit in METRIC_UNITS.items():
+            if name == 'BatchFillRatio':
+                declared = bool(fill_ratios)
+            else:
+                declared = name not in FEATURE_METRICS or values.get(name) or feature_enabled(FEATURE_METRICS[name])
+            if declared:
+                units[name] = unit
+        for name in sorted(values):
+            if name.endswith('Retries'):
+                units[name] = 'Count'
+        documents = [self.emf_document(units, values)]
+        for index in range(MAX_EMF_VALUES, len(fill_ratios), MAX_EMF_VALUES):
+            documents.append(self.emf_document({'BatchFillRatio': 'None'}, {'BatchFillRatio': fill_ratios[index:index + MAX_EMF_VALUES]}))
+        # the filter rules are also dimensioned by rule
+        rule_units = OrderedDict([('FilteredEvents', 'Count'), ('FilteredBytes', 'Bytes')])
+        for rule in sorted(set(rule for rule, _ in self.rule_values)):
+            rule_values = dict((name, self.rule_values[(rule, name)]) for name in rule_units)
+            documents.append(self.emf_document(rule_units, rule_values, rule))
+        documents.extend(self.activity_documents())
+        return documents
+
+    def activity_documents(self):
+        """
+        This function returns the embedded metric format records of the API call counters,
+        one per account, region, event source, event name and error code (None without error).
+        """
+        documents = []
+        for (account, region, event_source, event_name, error_code), count in sorted(self.activity.items(), key=str):
+            documents.append({
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': get_metrics_namespace(),
+                        'Dimensions': ACTIVITY_DIMENSIONS,
+                        'Metrics': [{'Name': 'ApiCalls', 'Unit': 'Count'}],
+                    }],
+                },
+                'Account': str(account),
+                'Region': str(region),
+                'EventSource': str(event_source),
+                'EventName': str(event_name),
+                'ErrorCode': str(error_code),
+                'ApiCalls': count,
+            })
+        return documents
+
+    def emf_document(self, units, values, rule=None):
+        dimensions = ['Source', 'Account'] + (['Rule'] if rule is not None else [])
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': get_metrics_namespace(),
+                    'Dimensions': [dimensions],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()],
+                }],
+            },
+            'Source': self.source,
+            'Account': self.account,
+        }
+        if rule is not None:
+            document['Rule'] = rule
+        for name in units:
+            value = values.get(name, 0)
+            document[name] = round(value, 1) if isinstance(value, float) else value
+        return document
+
+def feature_enabled(feature):
+    """
+    This function tells if an optional feature is enabled, from the getters of its settings.
+
+        :param feature: The name of the feature in FEATURE_METRICS.
+    """
+    if feature == 'FilterRules':
+        return get_filter_rules().active
+    if feature == 'CisDetection':
+        return get_detection_engine() is not None
+    if feature == 'ConfigDedup':
+        return deduplicate_config()
+    return archive_records()
+
+def current_metrics():
+    """
+    This function returns the metrics bound to the current thread, or metrics
+    that are not reported when the thread ships no log stream.
+    """
+    metrics = getattr(CURRENT_METRICS, 'metrics', None)
+    if metrics is None:
+        return ShippingMetrics(None, None)
+    return metrics
+
+def emit_metrics(metrics):
+    """
+    This function writes the metrics of the invocation to the standard output in
+    the CloudWatch embedded metric format, one record per source and linked account.
+    With EMIT_METRICS false, only the API call counters of AGGREGATE_ACTIVITY are written:
+    they are not kept anywhere else.
+
+        :param metrics: The metrics of the log streams shipped by the invocation.
+    """
+    shipping_metrics = emit_metrics_enabled()
+    if not shipping_metrics and not aggregate_activity():
+        return
+    merged = OrderedDict()
+    for stream_metrics in metrics:
+        key = (stream_metrics.source, stream_metrics.account)
+        if key not in merged:
+            merged[key] = ShippingMetrics(*key)
+        merged[key].merge(stream_metrics)
+    for account_metrics in merged.values():
+        documents = account_metrics.emf_documents() if shipping_metrics else account_metrics.activity_documents()
+        for document in documents:
+            print(json.dumps(document), flush=True)
+
+def split_message(message, identity, max_event_size=MAX_EVENT_SIZE, overhead=ITEM_BYTES_OVERHEAD):
+    """
+    This function splits a message too large for a log event into chunk events of at
+    most max_event_size bytes. Each chunk is a JSON object holding the identity fields
+    of the record, the id shared by the chunks (the SHA-256 of the message), its part
+    number, the number of parts and a slice of the message: the record is rebuilt by
+    concatenating the data of the parts in order. The split only depends on the
+    message, so a redelivered record is split the same way.
+
+        :param message: The serialized record.
+        :param identity: The fields identifying the record.
+        :param max_event_size: The maximum size of a log event, including the overhead.
+        :param overhead: The bytes counted for each log event on top of its message.
+    """
+    header = OrderedDict(identity)
+    header['splitId'] = hashlib.sha256(message.encode('utf-8')).hexdigest()
+    header['part'] = header['parts'] = 0
+    header['data'] = ''
+    # room left for the data, keeping digits for the part numbers
+    budget = max_event_size - event_size_bytes(json.dumps(header), overhead) - 16
+    slices = []
+    position = 0
+    while position < len(message):
+        length = budget
+        while True:
+            data = message[position:position + length]
+            # quotes, backslashes and non ASCII characters are escaped in the chunk
+            size = len(json.dumps(data)) - 2
+            if size <= budget:
+                break
+            length = max(1, length * budget // size - 1)
+        slices.append(data)
+        position += len(data)
+    chunks = []
+    for part, data in enumerate(slices, 1):
+        header['part'] = part
+        header['parts'] = len(slices)
+        header['data'] = data
+        chunks.append(json.dumps(header))
+    return chunks
+
+def archive_value(value):
+    """
+    This function returns the value of a string column of the archive: strings unchanged,
+    the other values as JSON text.
+
+        :param value: The value of the record field, None when it is missing.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    return ARCHIVE_ENCODER.encode(value)
+
+def event_size_bytes(message, overhead=ITEM_BYTES_OVERHEAD):
+    """
+    This function returns the size of a log event as counted by CloudWatch:
+    the message length in UTF-8 plus the per event overhead.
+
+        :param message: The message of the log event.
+        :param overhead: The bytes counted for each log event on top of its message.
+    """
+    if message.isascii():
+        return len(message) + overhead
+    return len(message.encode('utf-8')) + overhead
+
+def to_epoch_millis(value):
+    """
+    This function converts a CloudTrail / Config UTC timestamp (2020-01-01T00:00:00Z
+    or 2020-01-01T00:00:00.123Z) to epoch milliseconds, without strptime.
+
+        :param value: The timestamp to convert.
+    """
+    if len(value) >= 20 and value[-1] == 'Z' and (len(value) == 20 or value[19] == '.'):
+        millis = epoch_seconds(value[:19]) * 1000
+        if len(value) > 21:
+            millis += int((value[20:-1] + '00')[:3])
+        return millis
+    # other ISO-8601 forms are left to the standard library
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def epoch_seconds(value):
+    """
+    This function converts a YYYY-MM-DDTHH:MM:SS UTC timestamp to epoch seconds.
+    Records of a same file share few distinct seconds, hence the memoization.
+
+        :param value: The timestamp to convert.
+    """
+    if value[4] != '-' or value[7] != '-' or value[10] != 'T' or value[13] != ':' or value[16] != ':':
+        raise ValueError("Unsupported timestamp format: " + value)
+    return calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                            int(value[11:13]), int(value[14:16]), int(value[17:19])))
+
+def iter_decompressed(body):
+    """
+    This function decompresses the gzipped S3 object body chunk by chunk and
+    yields the decoded text, so the whole object is never held in memory.
+
+        :param body: The streaming body of the S3 object.
+    """
+    metrics = current_metrics()
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = b''
+    while True:
+        if not pending:
+            start = time.perf_counter()
+            pending = body.read(READ_CHUNK_SIZE)
+            metrics.add_time('ReadTime', start)
+            if not pending:
+                break
+        if decompressor.eof:
+            # concatenated gzip member
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+        start = time.perf_counter()
+        data = decompressor.decompress(pending, READ_CHUNK_SIZE)
+        metrics.add_time('DecompressTime', start)
+        metrics.add('DecompressedBytes', len(data))
+        pending = decompressor.unconsumed_tail or decompressor.unused_data
+        text = decoder.decode(data)
+        if text:
+            yield text
+    if not decompressor.eof:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+def iter_json_array(chunks, field):
+    """
+    This function yields one by one the items of the array stored under the
+    given key of a top-level JSON object, reading the text chunks on demand.
+
+        :param chunks: An iterator over the text chunks of the JSON document.
+        :param field: The top-level key holding the array (e.g. Records).
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    eof = False
+
+    def more(minimum=1):
+        # read at least minimum more characters, dropping the consumed prefix
+        nonlocal buffer, position, eof
+        parts = [buffer[position:]]
+        length = len(parts[0])
+        target = length + minimum
+        while length < target and not eof:
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+            else:
+                parts.append(chunk)
+                length += len(chunk)
+        buffer = ''.join(parts)
+        position = 0
+
+    def peek():
+        # return the next non whitespace character without consuming it
+        nonlocal position
+        while True:
+            match = JSON_WHITESPACE.match(buffer, position)
+            position = match.end()
+            if position < len(buffer):
+                return buffer[position]
+            if eof:
+                return ''
+            more()
+
+    def expect(characters):
+        nonlocal position
+        character = peek()
+        if not character or character not in characters:
+            raise ValueError("Malformed JSON document: expecting one of '" + characters + "' for key " + field)
+        position += 1
+        return character
+
+    def decode():
+        # decode the next JSON value, reading more text until it is complete
+        nonlocal position
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                if end < len(buffer) or eof:
+                    position = end
+                    return value
+                # a value ending on the buffer boundary may be truncated (e.g. numbers)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            more(max(len(buffer) - position, READ_CHUNK_SIZE))
+
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        key = decode()
+        expect(':')
+        if key == field:
+            expect('[')
+            if peek() == ']':
+                position += 1
+            else:
+                while True:
+                    yield decode()
+                    if expect(',]') == ']':
+                        break
+        else:
+            decode()
+        if expect(',}') == '}':
+            return
+
+
+def get_client(service_name):
+    """
+    This function returns the client of the AWS service, created on first use and
+    then shared by the warm invocations of the container and the retries.
+
+        :param service_name: The name of the AWS service (e.g. logs, dynamodb).
+    """
+    client = CLIENTS.get(service_name)
+    if client is None:
+        with CLIENTS_LOCK:
+            client = CLIENTS.get(service_name)
+            if client is None:
+                client = boto3.client(service_name, config=CLIENT_CONFIG)
+                if service_name == 'dynamodb':
+                    client.meta.events.register('after-call', count_dynamodb_call)
+                CLIENTS[service_name] = client
+    return client
+
+def get_seclog_account():
+    """
+    This function returns the id of the SecLog account, whose own log files are not shipped:
+    the SECLOG_ACCOUNT_ID environment variable when it is set, the caller identity otherwise.
+    It is resolved once per container.
+    """
+    global SECLOG_ACCOUNT_ID
+    if SECLOG_ACCOUNT_ID is None:
+        SECLOG_ACCOUNT_ID = os.environ.get('SECLOG_ACCOUNT_ID') or get_client('sts').get_caller_identity()['Account']
+    return SECLOG_ACCOUNT_ID
+
+def count_dynamodb_call(**kwargs):
+    """
+    This function counts the DynamoDB calls in the metrics of the current thread.
+    """
+    current_metrics().add('DynamoDBCalls')
+
+def delete_sequence_token(log_group_name, log_stream):
+    """
+    This function delete the log stream's sequence token if there is one.
+
+        :param log_group_name: The name of the log group with the correct pattern.
+        :param log_stream: The name of the log stream.
+    """
+    client = get_client('dynamodb')
+    try:
+        response = client.delete_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={
+                'LogGroupName': {
+                    'S': log_group_name
+                },
+                'LogStreamName': {
+                    'S': log_stream
+                }
+            }
+        )
+        LOGGER.debug("PreExisting item deleted in DynamoDB Key: "+log_group_name+" "+log_stream)
+    except Exception:
+        LOGGER.debug("Item not present in DynamoDB Key: "+log_group_name+" "+log_stream)
+
+def get_sequence_token(log_group_name, log_stream):
+    """
+    This function gets the log stream's sequence token if there is one.
+
+        :param log_group_name: The name of the log group with the correct pattern.
+        :param log_stream: The name of the log stream.
+    """
+    client = get_client('dynamodb')
+    response = client.get_item(
+        TableName=DYNAMODB_TABLE_NAME,
+        Key={
+            'LogGroupName': {
+                'S': log_group_name
+            },
+            'LogStreamName': {
+                'S': log_stream
+            }
+        },
+        ConsistentRead=True
+    )
+    nextToken = response.get('Item', {}).get('NextSequenceToken', {}).get('S', None)
+
+    # if token not in DynamoDB, get token from logstream and save it to DynamoDB
+    if (nextToken is None):
+        LOGGER.debug("Token not found in DynamoDB for loggroup: "+log_group_name+" and stream: "+log_stream)
+        cloudwatch = get_client('logs')
+        response = cloudwatch.describe_log_streams(logGroupName=log_group_name,logStreamNamePrefix=log_stream)
+        li = list(filter(lambda ls: ls['logStreamName'] == log_stream, response['logStreams']))
+        if 'uploadSequenceToken' in li[0]:
+            nextToken = li[0]['uploadSequenceToken']
+        if (nextToken is not None):
+            save_next_sequence_token(log_group_name, log_stream, nextToken)
+        return nextToken
+    else:
+        return nextToken
+
+def create_log_stream(log_group_name, log_stream, force=False):
+    """
+    This function creates the log stream if it is necessary.
+
+        :param log_group_name: The name of the log group with the correct pattern.
+        :param log_stream: The name of the log stream that should be created.
+        :param force: Skip the existence check in DynamoDB (e.g. the stream was reported missing).
+    """
+    if not force and is_known_stream(log_group_name, log_stream):
+        return
+ # Create the logstream if needed
+    if ( force or not use_sequence_token() or logstream_exists(log_group_name,log_stream) is False):
+        try:
+            client = get_client('logs')
+            client.create_log_stream(logStreamName=log_stream, logGroupName=log_group_name)
+            if use_sequence_token():
+                delete_sequence_token(log_stream=log_stream, log_group_name=log_group_name)
+            remember_stream(log_group_name, log_stream)
+            LOGGER.info("Log Stream created")
+        except ClientError as client_error:
+            if client_error.response['Error']['Code'] == 'ResourceAlreadyExistsException':
+                LOGGER.debug("Log Stream already exists")
+                remember_stream(log_group_name, log_stream)
+        except Exception:
+            LOGGER.exception("Unexpected error while creating the log stream.")
+            raise
+    else:
+        remember_stream(log_group_name, log_stream)
+
+def is_known_stream(log_group_name, log_stream):
+    """
+    This function tells if the log stream is known to exist by this container.
+
+        :param log_group_name: The name of the log group with the correct pattern.
+        :param log_stream: The name of the log stream.
+    """
+    key = (log_group_name, log_stream)
+    with KNOWN_STREAMS_LOCK:
+        expiry = KNOWN_STREAMS.get(key)
+        if expiry is None:
+            return False
+        if expiry < time.monotonic():
+            del KNOWN_STREAMS[key]
+            return False
+        KNOWN_STREAMS.move_to_end(key)
+        return True
+
+def remember_stream(log_group_name, log_stream):
+    """
+    This function records that the log stream exists, evicting the least
+    recently used streams above KNOWN_STREAMS_MAX_SIZE for each shard.
+
+        :param log_group_name: The name of the log group with the correct pattern.
+        :param log_stream: The name of the log stream.
+    """
+    key = (log_group_name, log_stream)
+    with KNOWN_STREAMS_LOCK:
+        KNOWN_STREAMS[key] = time.monotonic() + KNOWN_STREAMS_TTL_SECONDS
+        KNOWN_STREAMS.move_to_end(key)
+        while len(KNOWN_STREAMS) > KNOWN_STREAMS_MAX_SIZE * get_log_stream_shards():
+            KNOWN_STREAMS.popitem(last=False)
+
+def forget_stream(log_group_name, log_stream):
+    """
+    This function removes the log stream from the known streams.
+
+        :param log_group_name: The name of the log group with the correct pattern.
+        :param log_stream: The name of the log stream.
+    """
+    with KNOWN_STREAMS_LOCK:
+        KNOWN_STREAMS.pop((log_group_name, log_stream), None)
+
+def cached_fingerprint(key):
+    """
+    This function returns the fingerprint of the last version shipped of the resource
+    known by this container, None when it is unknown or expired.
+
+        :param key: The (LogGroupName, LogStreamName) key of the resource.
+    """
+    with DEDUP_CACHE_LOCK:
+        entry = DEDUP_CACHE.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.time():
+            del DEDUP_CACHE[key]
+            return None
+        DEDUP_CACHE.move_to_end(key)
+        return entry[0]
+
+def remember_fingerprint(key, fingerprint, expiry):
+    """
+    This function records the fingerprint of the last version shipped of the resource for
+    at most DEDUP_CACHE_TTL_SECONDS, as another container may ship a newer one, evicting
+    the least recently used resources above DEDUP_CACHE_MAX_SIZE.
+
+        :param key: The (LogGroupName, LogStreamName) key of the resource.
+        :param fingerprint: The fingerprint of the version shipped.
+        :param expiry: The epoch time in seconds after which the version is shipped again.
+    """
+    with DEDUP_CACHE_LOCK:
+        DEDUP_CACHE[key] = (fingerprint, min(expiry, time.time() + DEDUP_CACHE_TTL_SECONDS))
+        DEDUP_CACHE.move_to_end(key)
+        while len(DEDUP_CACHE) > DEDUP_CACHE_MAX_SIZE:
+            DEDUP_CACHE.popitem(last=False)
+
+def logstream_exists(log_group_name,log_stream):
+    """
+    This function check if the log stream already exists in the DynamoDB table
+
+        :param log_group_name: The name of the log group with the correct pattern.
+        :param log_stream: The name of the log stream.
+    """
+    client = get_client('dynamodb')
+    response = client.get_item(
+        TableName=DYNAMODB_TABLE_NAME,
+        Key={
+            'LogGroupName': {
+                'S': log_group_name
+            },
+            'LogStreamName': {
+                'S': log_stream
+            }
+        },
+        ConsistentRead=True
+    )
+    logstream_inDB = response.get('Item', {}).get('LogStreamName', {}).get('S', None)
+
+    # if logstream not in DynamoDB return False otherwise return True
+    if (logstream_inDB is None):
+        LOGGER.debug("Log Stream not found in DynamoDB for loggroup: "+log_group_name+" and stream: "+log_stream)
+        return False
+    else:
+        return True
+
+def save_next_sequence_token(log_group_name, log_stream, sequence_token):
+    """
+    This function saves the next sequence token to be used for the specified
+    log group and log stream.
+
+        :param log_group_name: The name of the log group with the correct pattern.
+        :param log_stream: The name of the log stream.
+        :param sequence_token: The next sequence token to save.
+    """
+    client = get_client('dynamodb')
+    LOGGER.debug('Saving next sequence token: [%s - %s - %s]',
+                log_group_name, log_stream, sequence_token)
+    client.put_item(
+        TableName=DYNAMODB_TABLE_NAME,
+        Item={
+            'LogGroupName': {'S': log_group_name},
+            'LogStreamName': {'S': log_stream},
+            'NextSequenceToken': {'S': sequence_token},
+            'TTL': {'N': str(int(time.time()) + SEVEN_DAYS_IN_SECONDS)},
+        }
+    )
+
+def internal_put_log_events(client, log_stream, log_group_name, sequence_token, log_events):
+    """
+    This function is responsible to send the log events to CloudWatch at the logging account.
+
+        :param log_stream: The name of the log stream.
+        :param log_group_name: The name of the log_group.
+        :param sequence_token: The sequence token to use if it is necessary.
+        :param log_events: The dict containing all the log events to be added.
+        :param client: the AWS logs client
+    """
+    if (sequence_token == "null" or sequence_token is None):
+        response = client.put_log_events(logStreamName=log_stream,
+                                         logGroupName=log_group_name,
+                                         logEvents=log_events)
+    else:
+        response = client.put_log_events(logStreamName=log_stream,
+                                         logGroupName=log_group_name,
+                                         sequenceToken=sequence_token,
+                                         logEvents=log_events)
+
+    if 'rejectedLogEventsInfo' in response:
+        LOGGER.warning('Log events rejected by CloudWatch: %s', response['rejectedLogEventsInfo'])
+    if not use_sequence_token():
+        return
+    if ('nextSequenceToken' in response):
+        nextSequenceToken = response['nextSequenceToken']
+        if (sequence_token != nextSequenceToken):
+            LOGGER.debug("nextSequenceToken: "+str(nextSequenceToken))
+            save_next_sequence_token(log_group_name, log_stream, nextSequenceToken)
+    else:
+        LOGGER.debug("nextSequenceToken key not found in put_log_events response: "+str(type(response)))
+        for key in response:
+            LOGGER.debug('key:'+str(key)+' value:'+str(response[key]))
+
+def ship_log_events(log_group_name, log_stream, log_events, deadline=None):
+    """
+    This function sends a batch of log events to the log stream. The sequence token
+    is only looked up when the tokenless mode is disabled or has been rejected.
+
+        :param log_group_name: The name of the log_group.
+        :param log_stream: The name of the log stream.
+        :param log_events: The list of log events to be added.
+        :param deadline: The time.monotonic() value after which no retry is attempted.
+    """
+    sequence_token = None
+    if use_sequence_token():
+        sequence_token = get_sequence_token(log_group_name, log_stream)
+    put_log_events(log_stream, log_group_name, sequence_token, log_events, deadline)
+
+def put_log_events(log_stream, log_group_name, sequence_token, log_events, deadline=None):
+    """
+    This function is responsible to send the log events to CloudWatch at the logging account.
+    Failed calls are retried up to MAX_TRY times with an exponential backoff and full
+    jitter depending on the error (see RETRY_POLICIES), as long as the deadline allows it.
+
+        :param log_stream: The name of the log stream.
+        :param log_group_name: The name of the log_group.
+        :param sequence_token: The sequence token to use if it is necessary.
+        :param log_events: The dict containing all the log events to be added.
+        :param deadline: The time.monotonic() value after which no retry is attempted.
+    """
+    client = get_client('logs')
+    max_try = get_max_try()
+    attempt = 1
+    while True:
+        try:
+            internal_put_log_events(client, log_stream, log_group_name, sequence_token, log_events)
+            return attempt
+        except ClientError as client_error:
+            code = client_error.response['Error']['Code']
+            if code not in RETRY_POLICIES:
+                LOGGER.exception("Unexpected error while putting events.")
+                raise
+            LOGGER.info('%s', json.dumps(client_error.response, default=str))
+            if code == 'DataAlreadyAcceptedException':
+                # the batch was stored by a previous attempt, keep the token for the next batch
+                expected_token = client_error.response.get('expectedSequenceToken')
+                if use_sequence_token() and expected_token is not None:
+                    save_next_sequence_token(log_group_name, log_stream, expected_token)
+                return attempt
+            if attempt >= max_try:
+                raise Exception("Too many " + code + " to write log") from client_error
+            if code == 'ResourceNotFoundException':
+                forget_stream(log_group_name, log_stream)
+                create_log_stream(log_group_name, log_stream, force=True)
+            elif code == 'InvalidSequenceTokenException':
+                if not use_sequence_token():
+                    require_sequence_token()
+                # retry with the token expected by CloudWatch, DynamoDB only when it is not given
+                sequence_token = client_error.response.get('expectedSequenceToken')
+                if sequence_token is None:
+                    sequence_token = get_sequence_token(log_group_name, log_stream)
+                LOGGER.info('Retrying with sequence_token: '+str(sequence_token))
+            seconds = backoff_delay(code, attempt)
+            if deadline is not None and time.monotonic() + seconds > deadline:
+                raise Exception("Lambda deadline reached while retrying " + code + " to write log") from client_error
+            LOGGER.info('Throttling %.2fs in loop %d', seconds, attempt)
+            current_metrics().add(code.replace('Exception', '') + 'Retries')
+            time.sleep(seconds)
+            attempt += 1
+
+def put_record_batch(delivery_stream_name, log_events, deadline=None):
+    """
+    This function sends the log events to the Firehose delivery stream. The records
+    rejected in the response are sent again alone, and a failed call entirely, up to
+    MAX_TRY times with the backoff of the error (see RETRY_POLICIES), as long as the
+    deadline allows it.
+
+        :param delivery_stream_name: The name of the Firehose delivery stream.
+        :param log_events: The list of log events to be sent.
+        :param deadline: The time.monotonic() value after which no retry is attempted.
+    """
+    client = get_client('firehose')
+    max_try = get_max_try()
+    records = [{'Data': (log_event['message'] + '\n').encode('utf-8')} for log_event in log_events]
+    attempt = 1
+    while True:
+        try:
+            response = client.put_record_batch(DeliveryStreamName=delivery_stream_name, Records=records)
+        except ClientError as client_error:
+            code = client_error.response['Error']['Code']
+            if code not in RETRY_POLICIES:
+                LOGGER.exception("Unexpected error while putting records.")
+                raise
+        else:
+            if response['FailedPutCount'] == 0:
+                return attempt
+            failed = [(record, result['ErrorCode']) for record, result in zip(records, response['RequestResponses'])
+                      if result.get('ErrorCode')]
+            records = [record for record, _ in failed]
+            code = failed[0][1]
+            LOGGER.info('%d records rejected by Firehose, first error: %s', len(records), code)
+        if attempt >= max_try:
+            raise Exception("Too many " + code + " to write records")
+        seconds = backoff_delay(code if code in RETRY_POLICIES else 'ServiceUnavailableException', attempt)
+        if deadline is not None and time.monotonic() + seconds > deadline:
+            raise Exception("Lambda deadline reached while retrying " + code + " to write records")
+        current_metrics().add(code.replace('Exception', '') + 'Retries')
+        time.sleep(seconds)
+        attempt += 1
+
+def backoff_delay(code, attempt):
+    """
+    This function returns the delay before the next attempt: a random value between
+    zero and the exponential backoff of the error policy (full jitter).
+
+        :param code: The error code of the failed attempt.
+        :param attempt: The number of the failed attempt, starting at 1.
+    """
+    base, cap = RETRY_POLICIES[code]
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+def get_deadline(context):
+    """
+    This function returns the time.monotonic() value after which retries are given up,
+    keeping DEADLINE_MARGIN_SECONDS before the Lambda timeout.
+
+        :param context: The Lambda context of the invocation.
+    """
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - DEADLINE_MARGIN_SECONDS
+
+# the environment variables do not change during the life of a container,
+# the functions reading them are memoized
+@lru_cache(maxsize=1)
+def check_log_level():
+    """
+    This function tests the log level which has been set.
+    """
+    log_level = get_log_level()
+    if log_level not in ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
+        log_level = "INFO"
+    return log_level
+
+@lru_cache(maxsize=1)
+def get_log_level():
+    """
+    This function gets the LogLevel from the environment variables table.
+    """
+    return os.environ.get('LOG_LEVEL', 'INFO')
+
+
+@lru_cache(maxsize=1)
+def get_max_workers():
+    """
+    This function gets the number of log streams shipped in parallel from the environment variables table.
+    """
+    return int(os.environ.get('MAX_WORKERS', MAX_WORKERS))
+
+def use_sequence_token():
+    """
+    This function tells if the sequence tokens stored in DynamoDB must be used,
+    either because USE_SEQUENCE_TOKEN is set or because a tokenless call was rejected.
+    """
+    return SEQUENCE_TOKEN_REQUIRED or sequence_token_configured()
+
+@lru_cache(maxsize=1)
+def sequence_token_configured():
+    """
+    This function gets USE_SEQUENCE_TOKEN from the environment variables table.
+    """
+    return os.environ.get('USE_SEQUENCE_TOKEN', 'false').lower() == 'true'
+
+def require_sequence_token():
+    """
+    This function switches the container back to the sequence tokens stored in DynamoDB.
+    """
+    global SEQUENCE_TOKEN_REQUIRED
+    LOGGER.warning('Tokenless PutLogEvents rejected, falling back to the sequence tokens stored in DynamoDB')
+    SEQUENCE_TOKEN_REQUIRED = True
+
+@lru_cache(maxsize=1)
+def get_max_try():
+    """
+    This function gets the maximum number of PutLogEvents attempts from the environment variables table.
+    """
+    return int(os.environ.get('MAX_TRY', MAX_TRY))
+
+@lru_cache(maxsize=1)
+def get_log_stream_shards():
+    """
+    This function gets the number of log streams per account, source and region from the environment variables table.
+    """
+    return max(1, int(os.environ.get('LOG_STREAM_SHARDS', 1)))
+
+@lru_cache(maxsize=1)
+def emit_metrics_enabled():
+    """
+    This function tells if the embedded metric format records are written (EMIT_METRICS, true by default).
+    """
+    return os.environ.get('EMIT_METRICS', 'true').lower() == 'true'
+
+@lru_cache(maxsize=1)
+def aggregate_activity():
+    """
+    This function tells if the API calls of the CloudTrail records are counted into
+    metrics while they are shipped (AGGREGATE_ACTIVITY, false by default).
+    """
+    return os.environ.get('AGGREGATE_ACTIVITY', 'false').lower() == 'true'
+
+@lru_cache(maxsize=1)
+def deduplicate_config():
+    """
+    This function tells if the configuration items identical to the last version shipped
+    of their resource are skipped (CONFIG_DEDUP, false by default).
+    """
+    return os.environ.get('CONFIG_DEDUP', 'false').lower() == 'true'
+
+@lru_cache(maxsize=1)
+def get_dedup_ttl():
+    """
+    This function gets the seconds after which an unchanged configuration item is shipped
+    again from the environment variables table (CONFIG_DEDUP_TTL, seven days by default).
+    """
+    return int(os.environ.get('CONFIG_DEDUP_TTL', SEVEN_DAYS_IN_SECONDS))
+
+@lru_cache(maxsize=1)
+def archive_records():
+    """
+    This function tells if the records are archived as Parquet files (ARCHIVE_RECORDS, false by default).
+    The archive needs pyarrow: without it the records are only shipped.
+    """
+    if os.environ.get('ARCHIVE_RECORDS', 'false').lower() != 'true':
+        return False
+    if pyarrow is None:
+        LOGGER.error('ARCHIVE_RECORDS is set but pyarrow is not installed, the records are not archived')
+        return False
+    return True
+
+@lru_cache(maxsize=1)
+def get_archive_bucket():
+    """
+    This function gets the S3 bucket of the archive from the environment variables table,
+    None to archive the records in the bucket of their log files.
+    """
+    return os.environ.get('ARCHIVE_BUCKET') or None
+
+@lru_cache(maxsize=1)
+def get_archive_prefix():
+    """
+    This function gets the S3 key prefix of the archive from the environment variables table.
+    """
+    return os.environ.get('ARCHIVE_PREFIX', ARCHIVE_PREFIX)
+
+@lru_cache(maxsize=1)
+def get_archive_compact_buckets():
+    """
+    This function gets the S3 buckets whose archive is compacted from the ARCHIVE_BUCKETS
+    environment variable (comma separated names).
+    """
+    return [name.strip() for name in os.environ['ARCHIVE_BUCKETS'].split(',') if name.strip()]
+
+@lru_cache(maxsize=1)
+def get_archive_compact_days():
+    """
+    This function gets the number of past days whose partitions are compacted from the environment variables table.
+    """
+    return int(os.environ.get('ARCHIVE_COMPACT_DAYS', ARCHIVE_COMPACT_DAYS))
+
+@lru_cache(maxsize=1)
+def get_archive_row_group_rows():
+    """
+    This function gets the number of records of a row group of the archive from the environment variables table.
+    """
+    return max(1, int(os.environ.get('ARCHIVE_ROW_GROUP_ROWS', ARCHIVE_ROW_GROUP_ROWS)))
+
+@lru_cache(maxsize=1)
+def get_metrics_namespace():
+    """
+    This function gets the CloudWatch namespace of the metrics from the environment variables table.
+    """
+    return os.environ.get('METRICS_NAMESPACE', METRICS_NAMESPACE)
+
+@lru_cache(maxsize=1)
+def get_source_adapters():
+    """
+    This function gets the source adapters enabled in the LOG_SOURCES environment variable
+    (comma separated names), all of them by default.
+    """
+    names = os.environ.get('LOG_SOURCES')
+    if not names:
+        return SOURCE_ADAPTERS
+    names = [name.strip() for name in names.split(',')]
+    return [adapter for adapter in SOURCE_ADAPTERS if adapter.name in names]
+
+@lru_cache(maxsize=1)
+def get_filter_rules():
+    """
+    This function gets the filter rules from the FILTER_RULES environment variable, or from
+    the SSM parameter named by FILTER_RULES_PARAMETER, both holding their JSON definition.
+    No record is filtered when neither is set.
+    """
+    definition = os.environ.get('FILTER_RULES')
+    parameter_name = os.environ.get('FILTER_RULES_PARAMETER')
+    if not definition and parameter_name:
+        definition = get_client('ssm').get_parameter(Name=parameter_name, WithDecryption=True)['Parameter']['Value']
+    rules = FilterRules(json.loads(definition) if definition else None)
+    LOGGER.info('%d filter rules loaded', len(rules.rules))
+    return rules
+
+@lru_cache(maxsize=1)
+def get_detection_engine():
+    """
+    This function gets the CIS detection engine when CIS_DETECTION is true, None otherwise.
+    CIS_PATTERNS lists the names of the patterns evaluated, the ones of the alarms
+    deployed by default when it is not set.
+    """
+    if os.environ.get('CIS_DETECTION', 'false').lower() != 'true':
+        return None
+    names = os.environ.get('CIS_PATTERNS')
+    if names:
+        names = [name.strip() for name in names.split(',')]
+        patterns = [pattern for pattern in DETECTION_PATTERNS if pattern.name in names]
+    else:
+        patterns = [pattern for pattern in DETECTION_PATTERNS if pattern.enabled]
+    return DetectionEngine(patterns)
+
+@lru_cache(maxsize=1)
+def get_alert_suppression_seconds():
+    """
+    This function gets the suppression window of the CIS alerts in seconds from the environment variables table.
+    """
+    return int(os.environ.get('ALERT_SUPPRESSION_SECONDS', ALERT_SUPPRESSION_SECONDS))
+
+def get_alert_topic_arn():
+    """
+    This function gets the ARN of the SNS topic of the CIS alerts from the environment variables table.
+    """
+    return os.environ['ALERT_TOPIC_ARN']
+
+@lru_cache(maxsize=1)
+def get_output_sink():
+    """
+    This function gets the output of the shipper from the environment variables table:
+    OUTPUT_SINK is cloudwatch (default) or firehose, the records being sent to the
+    delivery stream named by FIREHOSE_DELIVERY_STREAM.
+    """
+    sink_name = os.environ.get('OUTPUT_SINK', CloudWatchLogsSink.name).lower()
+    if sink_name == FirehoseSink.name:
+        return FirehoseSink(os.environ['FIREHOSE_DELIVERY_STREAM'])
+    if sink_name != CloudWatchLogsSink.name:
+        raise ValueError("Unsupported OUTPUT_SINK: " + sink_name)
+    return CloudWatchLogsSink()
+
+def init_container():
+    """
+    This function resolves what does not change between invocations (clients, SecLog
+    account, settings, log groups) during the init phase of the container, before its
+    first invocation. What fails here is resolved again on first use.
+    """
+    try:
+        for service_name in ('s3', 'dynamodb', 'firehose' if get_output_sink().name == FirehoseSink.name else 'logs'):
+            get_client(service_name)
+        for adapter in get_source_adapters():
+            adapter.log_group()
+        LOGGER.setLevel(check_log_level())
+        get_filter_rules()
+        if aggregate_activity() and not emit_metrics_enabled():
+            LOGGER.warning('EMIT_METRICS is false: only the API call counters of AGGREGATE_ACTIVITY are written')
+        if get_detection_engine() is not None:
+            get_client('sns')
+        get_seclog_account()
+    except Exception:
+        LOGGER.exception('Container initialization failed')
+
+# the module is imported during the init phase of the Lambda container
+if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ:
+    init_container()